@@ -1,97 +1,100 @@
 
+import numpy as np
 import pandas as pd
 import os
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
+
+# Mark half-open [start, end) index ranges in a length-n 0/1 array: +1 at each start and
+# -1 at each end, so the running sum is positive exactly inside a range
+def _mark_ranges(n, starts, ends):
+    delta = np.zeros(n + 1, dtype=np.int32)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, ends, -1)
+    return (np.cumsum(delta)[:-1] > 0).astype(np.int8)
 
 # Function to calculate NREM packets
 def calculate_nrem_packets(file_path):
-    # Read the CSV file
-    df = pd.read_csv(file_path)
+    # Read the CSV file with Arrow's multithreaded reader; it infers ISO timestamps as
+    # datetimes
+    df = pd.read_csv(file_path, engine='pyarrow', dtype=STAGE_DTYPES)
 
     # Ensure the required columns exist
     if 'sleepStage' not in df.columns or 'Timestamp' not in df.columns:
         raise ValueError("The input CSV must contain 'sleepStage' and 'Timestamp' columns.")
 
-    # Convert Timestamp to datetime for accuracy (optional, if needed)
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-
-    # Add a new column 'NREMpacket' initialized with 0
-    df['NREMpacket'] = 0
-
-    # Find continuous runs of sleepStage = 2
-    run_start = None
+    # Round stage codes to the nearest integer; blank stages stay NaN and match no stage
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
 
-    for i, stage in enumerate(df['sleepStage']):
-        if stage == 2:
-            if run_start is None:
-                run_start = i
-        else:
-            if run_start is not None:
-                run_length = i - run_start
-                if run_length >= 20:  # Minimum 20 seconds run
-                    df.loc[run_start:i-1, 'NREMpacket'] = 1  # Mark up to i-1, not i
-                run_start = None
+    # Find continuous runs of sleepStage = 2 from the edges of the NREM mask: +1 marks a
+    # run start and -1 the position just past its end
+    is_nrem = (df['sleepStage'].to_numpy() == 2).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], is_nrem, [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
 
-    # Handle case where the last rows are part of a valid run
-    if run_start is not None:
-        run_length = len(df) - run_start
-        if run_length >= 20:
-            df.loc[run_start:, 'NREMpacket'] = 1
+    # Mark runs of at least 20 samples (minimum 20 seconds run) as NREM packets
+    keep = (run_ends - run_starts) >= 20
+    df['NREMpacket'] = _mark_ranges(len(df), run_starts[keep], run_ends[keep])
 
     # Return the updated DataFrame
     return df
 
 # Function to calculate REM episodes
 def calculate_rem_episodes(df):
-    # Add a new column 'REMepisode' initialized with 0
-    df['REMepisode'] = 0
-    df['NREMepisode'] = 0  # Initialize NREMepisode column
-
-    # Find continuous runs of sleepStage = 3 (REM)
-    rem_runs = []
-    run_start = None
-
-    for i, stage in enumerate(df['sleepStage']):
-        if stage == 3:
-            if run_start is None:
-                run_start = i
-        else:
-            if run_start is not None:
-                rem_runs.append((run_start, i - 1))  # Mark the run up to i-1
-                run_start = None
-
-    # Handle case where the last rows are part of a valid REM run
-    if run_start is not None:
-        rem_runs.append((run_start, len(df) - 1))  # End with the last valid index
-
-    # Merge REM runs if gaps are less than 40 seconds and no NREM (sleepStage = 2) in the gap
-    merged_rem_runs = []
-    previous_run = rem_runs[0]
-
-    for current_run in rem_runs[1:]:
-        gap_start = previous_run[1] + 1
-        gap_end = current_run[0] - 1
-
-        # Check if there's a sleepStage=2 (NREM) within the gap
-        if (gap_end - gap_start + 1) < 40:
-            # If gap contains sleepStage=2 (NREM), don't merge the runs
-            if (df['sleepStage'][gap_start:gap_end + 1] == 2).any():
-                # Mark NREMepisode as 1 for the gap
-                df.loc[gap_start:gap_end, 'NREMepisode'] = 1
-                merged_rem_runs.append(previous_run)
-                previous_run = current_run
-            else:
-                # Merge the runs if no NREM (sleepStage=2) in the gap
-                previous_run = (previous_run[0], current_run[1])
-        else:
-            merged_rem_runs.append(previous_run)
-            previous_run = current_run
-
-    # Add the last run
-    merged_rem_runs.append(previous_run)
-
-    # Mark REM episodes in the DataFrame
-    for start, end in merged_rem_runs:
-        df.loc[start:end, 'REMepisode'] = 1
+    stage = df['sleepStage'].to_numpy()
+
+    # Find continuous runs of sleepStage = 3 (REM); run ends are exclusive
+    is_rem = (stage == 3).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], is_rem, [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    # Gaps lie between consecutive runs. A prefix count of NREM samples tells whether a gap
+    # contains sleepStage = 2 without scanning it
+    gap_starts = run_ends[:-1]
+    gap_ends = run_starts[1:]
+    nrem_before = np.concatenate(([0], np.cumsum(stage == 2)))
+    gap_has_nrem = (nrem_before[gap_ends] - nrem_before[gap_starts]) > 0
+    short_gap = (gap_ends - gap_starts) < 40
+
+    # Short gaps containing NREM keep the runs apart and are marked as NREMepisode
+    nrem_gap = short_gap & gap_has_nrem
+    nrem_episode = _mark_ranges(len(df), gap_starts[nrem_gap], gap_ends[nrem_gap])
+
+    # Merge REM runs if gaps are less than 40 seconds and no NREM (sleepStage = 2) in the gap:
+    # an episode starts at a run not merged into its predecessor and ends at a run not
+    # merged into its successor
+    merge = short_gap & ~gap_has_nrem
+    opens_episode = np.ones(len(run_starts), dtype=bool)
+    opens_episode[1:] = ~merge
+    closes_episode = np.ones(len(run_ends), dtype=bool)
+    closes_episode[:-1] = ~merge
+
+    # Mark REM episodes
+    rem_episode = _mark_ranges(len(df), run_starts[opens_episode], run_ends[closes_episode])
+
+    df['REMepisode'] = rem_episode
+    df['NREMepisode'] = nrem_episode
 
     return df
 
@@ -101,76 +104,44 @@ def calculate_nrem_episodes(df):
     if 'NREMepisode' not in df.columns:
         df['NREMepisode'] = 0
 
-    # Find continuous runs of NREMpacket = 1 within eligible rows
-    nrem_runs = []
-    run_start = None
-
-    # Ensure that eligible_for_nrem is defined (e.g., no REMepisode)
-    eligible_for_nrem = df['REMepisode'] == 0
-
-    for i, (packet, eligible) in enumerate(zip(df['NREMpacket'], eligible_for_nrem)):
-        if packet == 1 and eligible:
-            if run_start is None:
-                run_start = i
-        else:
-            if run_start is not None:
-                nrem_runs.append((run_start, i - 1))  # Mark the run up to i-1
-                run_start = None
-
-    # Handle case where the last rows are part of a valid NREM run
-    if run_start is not None:
-        nrem_runs.append((run_start, len(df) - 1))  # End with the last valid index
+    # Find continuous runs of NREMpacket = 1 within eligible rows (no REMepisode)
+    rem_episode = df['REMepisode'].to_numpy() == 1
+    eligible_packet = (df['NREMpacket'].to_numpy() == 1) & ~rem_episode
+    edges = np.diff(np.concatenate(([0], eligible_packet.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
 
     # Merge NREM runs if gaps are less than 40 seconds and no REMepisode in the gap
-    merged_nrem_runs = []
-    previous_run = nrem_runs[0] if nrem_runs else None
-
-    for current_run in nrem_runs[1:]:
-        gap_start = previous_run[1] + 1
-        gap_end = current_run[0] - 1
-
-        # Check if there's a REMepisode = 1 within the gap
-        if (gap_end - gap_start + 1) < 40:
-            # If there's any REMepisode = 1 in the gap, do not merge
-            if (df['REMepisode'][gap_start:gap_end + 1] == 1).any():
-                merged_nrem_runs.append(previous_run)
-                previous_run = current_run
-            else:
-                # Merge the runs if no REMepisode in the gap
-                previous_run = (previous_run[0], current_run[1])
-        else:
-            merged_nrem_runs.append(previous_run)
-            previous_run = current_run
-
-    # Add the last run
-    if previous_run:
-        merged_nrem_runs.append(previous_run)
-
-    # Mark NREM episodes in the DataFrame
-    for start, end in merged_nrem_runs:
-        df.loc[start:end, 'NREMepisode'] = 1
-
-    return df
-
-# Function to calculate WAKE episodes
-def calculate_wake_episodes(df):
-    # Add a new column 'WAKEepisode' where both REMepisode and NREMepisode are 0
-    df['WAKEepisode'] = ((df['REMepisode'] == 0) & (df['NREMepisode'] == 0)).astype(int)
+    gap_starts = run_ends[:-1]
+    gap_ends = run_starts[1:]
+    rem_before = np.concatenate(([0], np.cumsum(rem_episode)))
+    gap_has_rem = (rem_before[gap_ends] - rem_before[gap_starts]) > 0
+    merge = ((gap_ends - gap_starts) < 40) & ~gap_has_rem
+    opens_episode = np.ones(len(run_starts), dtype=bool)
+    opens_episode[1:] = ~merge
+    closes_episode = np.ones(len(run_ends), dtype=bool)
+    closes_episode[:-1] = ~merge
+
+    # Mark NREM episodes on top of any set while calculating REM episodes
+    nrem_episode = _mark_ranges(len(df), run_starts[opens_episode], run_ends[closes_episode])
+    df['NREMepisode'] = nrem_episode | (df['NREMepisode'].to_numpy() == 1)
 
     return df
 
 # Function to create the sleepStageConsolidated column, remove old columns, and save to file
 def consolidate_sleep_stages(df, output_file_name):
-    # Create the 'sleepStageConsolidated' column based on the conditions
-    df['sleepStageConsolidated'] = 0
-    df.loc[df['WAKEepisode'] == 1, 'sleepStageConsolidated'] = 1
-    df.loc[df['NREMepisode'] == 1, 'sleepStageConsolidated'] = 2
-    df.loc[df['REMepisode'] == 1, 'sleepStageConsolidated'] = 3
-
-    # Remove the 'WAKEepisode', 'NREMepisode', and 'REMepisode' columns
-    df.drop(columns=['NREMpacket', 'WAKEepisode', 'NREMepisode', 'REMepisode'], inplace=True)
-
-    # Save the updated DataFrame to the output file with the provided name
+    # Create the 'sleepStageConsolidated' column: REM episodes take precedence over NREM
+    # episodes, and every row in neither is a wake episode
+    rem = df['REMepisode'].to_numpy()
+    nrem = df['NREMepisode'].to_numpy()
+    df['sleepStageConsolidated'] = np.where(rem == 1, 3, np.where(nrem == 1, 2, 1)).astype(np.int8)
+
+    # Remove the 'NREMpacket', 'NREMepisode', and 'REMepisode' columns
+    df.drop(columns=['NREMpacket', 'NREMepisode', 'REMepisode'], inplace=True)
+
+    # Save the updated DataFrame to the output file with the provided name; stage codes are
+    # written as integers (nullable, so blank stages stay empty)
+    df['sleepStage'] = df['sleepStage'].astype('Int8')
     df.to_csv(output_file_name, index=False)
 
     return df  # Optionally return the updated dataframe
@@ -188,9 +159,6 @@ df = calculate_rem_episodes(df)
 # Calculate NREM episodes
 df = calculate_nrem_episodes(df)
 
-# Calculate WAKE episodes
-df = calculate_wake_episodes(df)
-
 # Consolidate sleep stages and save to file
 consolidated_df = consolidate_sleep_stages(df, output_file_name)
 
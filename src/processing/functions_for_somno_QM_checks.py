@@ -8,6 +8,27 @@ import scipy.stats as stats
 import statsmodels.api as sm
 from statsmodels.formula.api import ols
 from statsmodels.stats.multicomp import pairwise_tukeyhsd
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import stage_code_array
 
 def match_length_csv_files(df1, df2):
     '''
@@ -86,18 +107,16 @@ def compare_csv_files_by_stage(df_manual, df_somnotate, stage_value):
         percentage_similarity: Percentage similarity between the manual and somnotate annotations for this sleep stage
     '''
 
-    # Get indices in the manual annotations where the sleep stage is equal to a given stage_value (e.g., 1 for 'awake')
-    manual_stage_indices = df_manual[df_manual['sleepStage'] == stage_value].index
+    # Ensure both DataFrames are of equal length, so the mask lines up with the somnotate samples
+    df_manual, df_somnotate = match_length_csv_files(df_manual, df_somnotate)
 
-    # Get the corresponding sleep stages in somnotate based on these indices
-    somnotate_stage_at_indices = df_somnotate.loc[manual_stage_indices, 'sleepStage']
+    # Mask the samples where the manual sleep stage is equal to a given stage_value (e.g., 1 for 'awake')
+    manual_stages = stage_code_array(df_manual['sleepStage'])
+    somnotate_stages = stage_code_array(df_somnotate['sleepStage'])
+    manual_stage_mask = manual_stages == stage_value
 
-    # Get the manual sleep stages at those same indices (should all be stage_value)
-    manual_stage_at_indices = df_manual.loc[manual_stage_indices, 'sleepStage']
-    assert manual_stage_at_indices.all() == stage_value, f"Manual sleep stages at indices {manual_stage_indices} are not all {stage_value}"
-
-    # Compare the two (manual vs somnotate) for those indices
-    matches = manual_stage_at_indices == somnotate_stage_at_indices
+    # Compare somnotate against the manual stage (stage_value by construction) at those samples
+    matches = somnotate_stages[manual_stage_mask] == stage_value
     percentage_similarity = np.mean(matches) * 100
 
     print(f"Percentage similarity for sleep stage {stage_value} (manual vs somnotate): {percentage_similarity:.2f}%")
@@ -117,19 +136,18 @@ def compute_confusion_matrix_by_stage(df_manual, df_somnotate, stages):
     # Ensure both DataFrames are of equal length
     df_manual, df_somnotate = match_length_csv_files(df_manual, df_somnotate) 
 
-    # Initialize the confusion matrix (N x N, where N is the number of stages)
+    # Confusion matrix (N x N, where N is the number of stages); rows: manual, columns: somnotate
     num_stages = len(stages)
-    confusion_matrix = np.zeros((num_stages, num_stages))  # Rows: manual, Columns: somnotate
-
-    for manual_stage_name, manual_stage_value in stages.items():
+    manual = stage_code_array(df_manual['sleepStage'])
+    somnotate = stage_code_array(df_somnotate['sleepStage'])
 
-        manual_stage_indices = df_manual[df_manual['sleepStage'] == manual_stage_value].index # get the indices where the manual stage is equal to the current stage value (e.g., 'awake')
-        somnotate_stage_at_indices = df_somnotate.loc[manual_stage_indices, 'sleepStage'] # get the somnotate stage at the same indices
+    # Count every (manual, somnotate) pair of stage values 1..N in one pass: each pair maps to
+    # a flat cell index of the N x N matrix
+    valid = np.isin(manual, list(stages.values())) & (somnotate >= 1) & (somnotate <= num_stages)
+    cells = (manual[valid].astype(np.intp) - 1) * num_stages + (somnotate[valid] - 1)
+    confusion_matrix = np.bincount(cells, minlength=num_stages * num_stages).reshape(num_stages, num_stages)
 
-        for somnotate_stage_value in somnotate_stage_at_indices:
-            confusion_matrix[stages[manual_stage_name] - 1, somnotate_stage_value - 1] += 1
-
-    return confusion_matrix
+    return confusion_matrix.astype(float)
 
 def plot_confusion_matrix(confusion_matrix, labels, title="Sleep Stage Confusion Matrix"):
     '''
@@ -170,28 +188,15 @@ def get_bout_durations(df, sampling_rate, df_name):
     # if 'sleepStage' not in df.columns:
     #     raise ValueError("The 'sleepStage' column is missing from the DataFrame.")
     
-    bout_durations_with_stage = []
-    bout_durations = []
-    bout_stages = []
     bout_durations_with_stage_all = {}
 
-    stage_changes = np.where(df['sleepStage'].diff() != 0)[0]
-
-    previous_time = 0 
-    previous_stage = df['sleepStage'].iloc[0]
-    
-
-    for stage_change in stage_changes:
-        bout_duration = (stage_change - previous_time) / sampling_rate
-        bout_durations.append(bout_duration)
-        bout_stages.append(previous_stage)
-
-        previous_time = stage_change
-        previous_stage = df['sleepStage'].iloc[stage_change]
-
-    final_bout_duration = (len(df) - previous_time) / sampling_rate
-    bout_durations.append(final_bout_duration)  # Add the duration of the last bout
-    bout_stages.append(previous_stage) # Add the stage of the last bout
+    # Run-length encode the sleep stages: bouts are bounded by the samples where the stage
+    # changes, plus the start and end of the recording
+    stages = stage_code_array(df['sleepStage'])
+    stage_changes = np.flatnonzero(np.diff(stages) != 0) + 1
+    boundaries = np.concatenate(([0], stage_changes, [len(stages)]))
+    bout_durations = np.diff(boundaries) / sampling_rate
+    bout_stages = stages[boundaries[:-1]]
 
     bout_durations_with_stage = pd.DataFrame({'BoutDuration': bout_durations, 'SleepStage': bout_stages})
     bout_durations_with_stage_all[df_name] = bout_durations_with_stage
@@ -343,6 +348,30 @@ def plot_bout_duration_histograms_with_significance(bout_durations_dict, sleep_s
     plt.show()
 
 
+def _bout_stages(df):
+    '''
+    Sleep stage of each bout (run of identical sleep stages) in a CSV file, in order.
+    Input:
+        df: DataFrame for the CSV file
+    Output:
+        bout_stages: Array with one sleep stage per bout
+    '''
+
+    stages = stage_code_array(df['sleepStage'])
+    bout_starts = np.ones(len(stages), dtype=bool)
+    bout_starts[1:] = stages[1:] != stages[:-1]
+
+    return stages[bout_starts]
+
+def _count_bout_transitions(df, from_stage, to_stage):
+    '''
+    Count the bouts of from_stage that are directly followed by a bout of to_stage.
+    '''
+
+    bout_stages = _bout_stages(df)
+
+    return int(np.count_nonzero((bout_stages[:-1] == from_stage) & (bout_stages[1:] == to_stage)))
+
 def count_transitions(df, df_name):
     ''' 
     Calculate the number of transitions between sleep stages in a CSV file.
@@ -353,8 +382,7 @@ def count_transitions(df, df_name):
     '''
 
     n_transitions_all = {}
-    stage_changes = np.where(df['sleepStage'].diff() != 0)[0]
-    n_transitions = len(stage_changes)
+    n_transitions = len(_bout_stages(df))
     n_transitions_all[df_name] = n_transitions
     print(f'The number of transitions for {df_name} is {n_transitions}')
 
@@ -370,11 +398,7 @@ def count_REM_to_non_REM_transitions(df, df_name):
     '''
 
     n_incorrect_transitions_all = {}
-    stage_changes = np.where(df['sleepStage'].diff() != 0)[0]
-    n_incorrect_transitions = 0
-    for i in range(len(stage_changes)-1):
-        if df['sleepStage'].iloc[stage_changes[i]] == 3 and df['sleepStage'].iloc[stage_changes[i+1]] == 2:
-            n_incorrect_transitions += 1
+    n_incorrect_transitions = _count_bout_transitions(df, 3, 2)
 
     n_incorrect_transitions_all[df_name] = n_incorrect_transitions
     print(f'The number of non-REM to REM transitions for {df_name} is {n_incorrect_transitions}')
@@ -393,11 +417,7 @@ def count_REM_to_awake_transitions(df, df_name):
     '''
 
     n_REM_to_awake_transitions_all = {}
-    stage_changes = np.where(df['sleepStage'].diff() != 0)[0]
-    n_REM_to_awake_transitions = 0
-    for i in range(len(stage_changes)-1):
-        if df['sleepStage'].iloc[stage_changes[i]] == 3 and df['sleepStage'].iloc[stage_changes[i+1]] == 1:
-            n_REM_to_awake_transitions += 1
+    n_REM_to_awake_transitions = _count_bout_transitions(df, 3, 1)
 
     n_REM_to_awake_transitions_all[df_name] = n_REM_to_awake_transitions
     print(f'The number of REM to awake transitions for {df_name} is {n_REM_to_awake_transitions}')
@@ -414,11 +434,7 @@ def count_non_REM_to_awake_transitions(df, df_name):
     '''
 
     n_non_REM_to_awake_transitions_all = {}
-    stage_changes = np.where(df['sleepStage'].diff() != 0)[0]
-    n_non_REM_to_awake_transitions = 0
-    for i in range(len(stage_changes)-1):
-        if df['sleepStage'].iloc[stage_changes[i]] == 2 and df['sleepStage'].iloc[stage_changes[i+1]] == 1:
-            n_non_REM_to_awake_transitions += 1
+    n_non_REM_to_awake_transitions = _count_bout_transitions(df, 2, 1)
 
     n_non_REM_to_awake_transitions_all[df_name] = n_non_REM_to_awake_transitions    
     print(f'The number of non-REM to awake transitions for {df_name} is {n_non_REM_to_awake_transitions}')
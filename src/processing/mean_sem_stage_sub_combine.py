@@ -2,10 +2,6 @@ import pandas as pd
 import os
 import numpy as np
 
-def calculate_sem(group):
-    """Calculate the standard error of the mean for each column."""
-    return group.std() / np.sqrt(len(group))
-
 def process_individual_file(input_file, subject_code):
     # Load the CSV file
     df = pd.read_csv(input_file)
@@ -16,14 +12,12 @@ def process_individual_file(input_file, subject_code):
         return None
 
     # Group by zeitgeber_time and calculate mean and SEM for percentages
-    result_df = df.groupby('ZT').agg(
-        wake_percent_mean=('wake_percent', 'mean'),
-        non_rem_percent_mean=('non_rem_percent', 'mean'),
-        rem_percent_mean=('rem_percent', 'mean'),
-        
-        wake_percent_sem=('wake_percent', calculate_sem),
-        non_rem_percent_sem=('non_rem_percent', calculate_sem),
-        rem_percent_sem=('rem_percent', calculate_sem)
+    percent_columns = ['wake_percent', 'non_rem_percent', 'rem_percent']
+    grouped = df.groupby('ZT')[percent_columns]
+    means = grouped.mean()
+    sems = grouped.std() / np.sqrt(grouped.count())
+    result_df = pd.concat(
+        [means.add_suffix('_mean'), sems.add_suffix('_sem')], axis=1
     ).reset_index()
 
     # Add the subject code column
@@ -32,7 +26,7 @@ def process_individual_file(input_file, subject_code):
     return result_df
 
 def process_multiple_files(input_files, output_file):
-    combined_results = pd.DataFrame()
+    results = []
 
     for input_file in input_files:
         # Prompt the user to enter a subject code for each file
@@ -42,8 +36,10 @@ def process_multiple_files(input_files, output_file):
         result_df = process_individual_file(input_file, subject_code)
 
         if result_df is not None:
-            # Append each result_df to the combined_results DataFrame
-            combined_results = pd.concat([combined_results, result_df], ignore_index=True)
+            # Collect each result_df; they are concatenated once after the loop
+            results.append(result_df)
+
+    combined_results = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
 
     # Save the combined results to CSV
     combined_results.to_csv(output_file, index=False)
@@ -9,16 +9,17 @@ def convert_to_zeitgeber_time(timestamp, lights_on_time='09:00', lights_off_time
     Drop the first row to minimise the effect of headset implantation stress.
     
     Parameters:
-    - timestamp (datetime): Original timestamp.
+    - timestamp (datetime or Series of datetimes): Original timestamp(s).
     - lights_on_time (str): Time representing ZT0 in HH:MM format (default '09:00').
     - lights_off_time (str): Time representing ZT12 in HH:MM format (default '21:00').
     
     Returns:
-    - float: Zeitgeber time (ZT0-ZT23) in fractional hours.
+    - float or Series: Zeitgeber time (ZT0-ZT23) in fractional hours.
     """
-    lights_on = pd.to_datetime(lights_on_time).time()
-    # Calculate the difference between the timestamp and lights_on in minutes
-    minutes_since_lights_on = (timestamp - pd.to_datetime(f"2000-01-01 {lights_on_time}")).total_seconds() / 60
+    # Calculate the difference between the timestamp and lights_on in minutes; dividing by a
+    # Timedelta works element-wise on a whole datetime column as well as on one timestamp
+    lights_on = pd.to_datetime(f"2000-01-01 {lights_on_time}")
+    minutes_since_lights_on = (timestamp - lights_on) / pd.Timedelta(minutes=1)
     # Convert to ZT (scaled to the 24-hour clock, where ZT0 = lights_on_time)
     zeitgeber_time = (minutes_since_lights_on / 60) % 24  # Convert minutes to fractional hours
     return zeitgeber_time
@@ -31,34 +32,31 @@ def process_sleep_data(input_file, output_file, bin_size, lights_on_time='09:00'
         # Ensure Timestamp is in datetime format
         df['Timestamp'] = pd.to_datetime(df['Timestamp'])
 
-        # Convert sleepStage column to closest integer
-        df['sleepStage'] = np.round(df['sleepStage'])
+        # Convert sleepStage column to closest integer; stage codes fit in (nullable) int8,
+        # so the per-stage comparisons below scan 1 byte per sample
+        df['sleepStage'] = np.round(df['sleepStage']).astype('Int8')
 
         # Create Zeitgeber time based on the specified lights-on and lights-off times
-        df['ZT'] = df['Timestamp'].apply(lambda x: convert_to_zeitgeber_time(x, lights_on_time, lights_off_time))
+        df['ZT'] = convert_to_zeitgeber_time(df['Timestamp'], lights_on_time, lights_off_time)
 
         # Create bins for the specified time interval (bin_size)
         df['time_bin'] = df['Timestamp'].dt.floor(bin_size)
 
-        # Calculate the percentage of each sleep stage within each time bin
-        wake_df = df[df['sleepStage'] == 1]
-        non_rem_df = df[df['sleepStage'] == 2]
-        rem_df = df[df['sleepStage'] == 3]
-
-        wake_percent = wake_df.groupby('time_bin')['sleepStage'].count() / df.groupby('time_bin')['sleepStage'].count() * 100
-        non_rem_percent = non_rem_df.groupby('time_bin')['sleepStage'].count() / df.groupby('time_bin')['sleepStage'].count() * 100
-        rem_percent = rem_df.groupby('time_bin')['sleepStage'].count() / df.groupby('time_bin')['sleepStage'].count() * 100
+        # Calculate the percentage of each sleep stage within each time bin from a single
+        # time_bin x stage tabulation; bins or stages without scored samples get 0
+        stage_percent = pd.crosstab(df['time_bin'], df['sleepStage'], normalize='index').mul(100)
+        stage_percent = stage_percent.reindex(index=np.sort(df['time_bin'].unique()), columns=[1, 2, 3], fill_value=0)
 
         # Create the result DataFrame and include Zeitgeber time
         result_df = pd.DataFrame({
-            'time_bin': wake_percent.index,
-            'wake_percent': wake_percent.values,
-            'non_rem_percent': non_rem_percent.values,
-            'rem_percent': rem_percent.values
+            'time_bin': stage_percent.index,
+            'wake_percent': stage_percent[1].to_numpy(),
+            'non_rem_percent': stage_percent[2].to_numpy(),
+            'rem_percent': stage_percent[3].to_numpy()
         })
 
         # Add Zeitgeber time for each time_bin in the result DataFrame
-        result_df['ZT'] = result_df['time_bin'].apply(lambda x: convert_to_zeitgeber_time(x, lights_on_time, lights_off_time))
+        result_df['ZT'] = convert_to_zeitgeber_time(result_df['time_bin'], lights_on_time, lights_off_time)
 
         # Drop the first row before saving
         result_df = result_df.iloc[1:]
@@ -14,22 +14,16 @@ def stitch_csv_files(*input_csv_files):
     # List to store dataframes from all input CSV files
     dataframes = []
 
-    # Iterate over the provided CSV file paths
-    for i, file in enumerate(input_csv_files):
-        if i == 0:
-            # Read the first CSV with the header
-            df = pd.read_csv(file)
-        else:
-            # Read subsequent CSVs, skipping the first row (header), without modifying column titles
-            df = pd.read_csv(file, skiprows=1, header=None)
-            df.columns = pd.read_csv(file, nrows=0).columns  # Use the column names from the first file
-        dataframes.append(df)
-
-    # Concatenate all dataframes row-wise
+    # Iterate over the provided CSV file paths; each file is read once with its own header row
+    for file in input_csv_files:
+        dataframes.append(pd.read_csv(file, header=0))
+
+    # Concatenate all dataframes row-wise; concat lines the rows up by column name
     stitched_data = pd.concat(dataframes, ignore_index=True)
 
-    # Ensure proper data types and remove stray commas
-    stitched_data = stitched_data.applymap(lambda x: x.strip(',') if isinstance(x, str) else x)
+    # Ensure proper data types and remove stray commas, one vectorised pass per text column
+    for col in stitched_data.select_dtypes(include=['object', 'string']).columns:
+        stitched_data[col] = stitched_data[col].str.strip(',')
     stitched_data = stitched_data.convert_dtypes()  # Ensure proper data types (e.g., int remains int)
 
     # Ask the user for the output file path
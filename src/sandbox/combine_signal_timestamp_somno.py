@@ -1,10 +1,13 @@
 import pandas as pd
 import numpy as np
-from scipy.signal import decimate
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from scipy.signal import resample_poly, firwin
 
 def load_csv(file_path):
     """Load a CSV file and return a DataFrame."""
-    df = pd.read_csv(file_path)
+    # Timestamps are only copied and sliced here, so they pass through as unparsed strings
+    df = pd.read_csv(file_path, dtype={'Timestamp': str})
     print(f"Loaded file: {file_path}")
     return df
 
@@ -25,19 +28,26 @@ def replace_sleepstage(eeg_emg_df, sleepstage_df):
 
 def downsample_data(df, columns, scale):
     """Downsample the selected columns by a given scale."""
-    downsampled_data = {}
-    for col in columns:
-        downsampled_data[col] = decimate(df[col].values, scale)
-    downsampled_df = pd.DataFrame(downsampled_data)
-    downsampled_df['Timestamp'] = df['Timestamp'].iloc[::scale].reset_index(drop=True)
-    downsampled_df['sleepStage'] = df['sleepStage'].iloc[::scale].reset_index(drop=True)
+    # Anti-aliasing FIR applied by a polyphase filter, so only the kept samples are computed
+    fir_coeffs = firwin(30 * scale + 1, 1.0 / scale)
+    signals = df[columns].to_numpy()
+    downsampled = resample_poly(signals, up=1, down=scale, axis=0, window=fir_coeffs)
+    downsampled_df = pd.DataFrame(downsampled, columns=columns)
+    downsampled_df['Timestamp'] = df['Timestamp'].values[::scale][:len(downsampled)]
+    downsampled_df['sleepStage'] = df['sleepStage'].values[::scale][:len(downsampled)]
     print(f"Data downsampled by a factor of {scale}.")
     return downsampled_df
 
 def save_combined_file(df, directory, subject, session, recording, extra_info, scale):
     """Save the processed DataFrame to a CSV file with a specified filename format."""
     filename = f"{directory}/combined_somno_downsampled_{subject}_{session}_{recording}_{extra_info}_scale_{scale}.csv"
-    df.to_csv(filename, index=False)
+    # Arrow's C CSV writer; header written by hand so it stays unquoted like to_csv.
+    # Floats are written in Arrow's shortest round-trip form rather than pandas' repr
+    # (1.0 -> 1, -2.5e-05 -> -0.000025): values read back identically, the text differs
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with open(filename, 'wb') as f:
+        f.write((','.join(df.columns) + '\n').encode())
+        pa_csv.write_csv(table, f, write_options=pa_csv.WriteOptions(include_header=False, quoting_style='none'))
     print(f"File saved successfully as: {filename}")
 
 def main():
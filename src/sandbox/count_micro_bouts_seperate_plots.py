@@ -1,10 +1,33 @@
 import pandas as pd
 import matplotlib.pyplot as plt
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 # Load CSV file
 def load_data(file_path):
     """Load CSV file into a pandas DataFrame."""
-    return pd.read_csv(file_path)
+    df = pd.read_csv(file_path, dtype=STAGE_DTYPES)
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
+    return df
 
 # Count micro bouts
 def count_micro_bouts(df):
@@ -15,19 +15,35 @@ def downsample_csv(input_file, output_file, sampling_rate):
         None
     """
 
-    # Load the CSV file
-    df = pd.read_csv(input_file)
-
-    # Ensure Timestamp is in datetime format
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-
-    # Set Timestamp as index
-    df.set_index('Timestamp', inplace=True)
-
-    # Resample data using mode
-    df_resampled = df.resample(f'{1000 // sampling_rate}ms').apply(
-        lambda x: x.mode().iloc[0] if not x.empty else np.nan
-    )
+    # Load the CSV file with Timestamp parsed straight into the index
+    # (a mode resample needs every row, so rows cannot be skipped while reading)
+    df = pd.read_csv(input_file, index_col='Timestamp', parse_dates=['Timestamp'])
+
+    # Resample data using mode. Bins follow resample's defaults: left-closed, labelled by
+    # their start and anchored at midnight of the first day
+    period_ns = (1000 // sampling_rate) * 10**6
+    timestamps = df.index.as_unit('ns')
+    origin_ns = timestamps.min().normalize().value
+    bin_id = (timestamps.asi8 - origin_ns) // period_ns
+    first_bin = bin_id.min()
+    bin_id = bin_id - first_bin
+    n_bins = bin_id.max() + 1
+
+    resampled = {}
+    for col in df.columns:
+        # Count each (bin, value) pair in one pass over integer codes; values are sorted, so
+        # argmax breaks ties towards the smallest value like Series.mode().iloc[0]
+        codes, uniques = pd.factorize(df[col], sort=True)
+        valid = codes >= 0
+        counts = np.bincount(bin_id[valid] * len(uniques) + codes[valid],
+                             minlength=n_bins * len(uniques)).reshape(n_bins, len(uniques))
+        has_values = counts.any(axis=1)
+        mode = pd.Series(uniques.take(counts.argmax(axis=1)))
+        # Bins without any samples are left empty
+        resampled[col] = mode if has_values.all() else mode.where(has_values)
+
+    bin_starts = pd.DatetimeIndex(origin_ns + (np.arange(n_bins) + first_bin) * period_ns, name=df.index.name)
+    df_resampled = pd.DataFrame(resampled).set_index(bin_starts)
 
     # Reset index
     df_resampled.reset_index(inplace=True)
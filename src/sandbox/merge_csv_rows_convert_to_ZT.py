@@ -57,11 +57,16 @@ def merge_csv_rows():
         # Concatenate dataframes vertically
         print("\nMerging rows from all files...")
         merged_df = pd.concat([df1, df2, df3], axis=0, ignore_index=True)
+
+        # Only the per-file row counts are needed from here on, so release the
+        # input frames instead of holding them alongside the merged copy
+        input_rows = [len(df1), len(df2), len(df3)]
+        del df1, df2, df3
         
         # Remove any duplicate rows if desired
         if input("\nWould you like to remove duplicate rows? (y/n): ").lower() == 'y':
             original_rows = len(merged_df)
-            merged_df = merged_df.drop_duplicates()
+            merged_df.drop_duplicates(inplace=True)
             removed_rows = original_rows - len(merged_df)
             print(f"Removed {removed_rows} duplicate rows.")
         
@@ -85,9 +90,9 @@ def merge_csv_rows():
         print(f"Total rows in merged file: {len(merged_df)}")
         print(f"Number of columns: {len(merged_df.columns)}")
         print("\nRows from each input file:")
-        print(f"Base file: {len(df1)} rows")
-        print(f"File 2: {len(df2)} rows")
-        print(f"File 3: {len(df3)} rows")
+        print(f"Base file: {input_rows[0]} rows")
+        print(f"File 2: {input_rows[1]} rows")
+        print(f"File 3: {input_rows[2]} rows")
         
         return merged_df
         
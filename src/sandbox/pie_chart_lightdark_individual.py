@@ -1,8 +1,30 @@
 import os
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import timedelta
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 # Set Seaborn theme
 sns.set_theme(style="whitegrid")
@@ -24,16 +46,17 @@ def create_pie_chart(stage_counts, output_path, title):
     print(f"Pie chart saved to: {output_path}")
 
 def aggregate_phases(df):
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    
-    # Filter for light phase (09:00 to 21:00)
-    light_phase_data = df[(df['Timestamp'].dt.time >= pd.Timestamp('09:00').time()) & 
-                          (df['Timestamp'].dt.time < pd.Timestamp('21:00').time())]
-    
-    # Filter for dark phase (21:00 to 09:00)
-    dark_phase_data = df[(df['Timestamp'].dt.time >= pd.Timestamp('21:00').time()) | 
-                         (df['Timestamp'].dt.time < pd.Timestamp('09:00').time())]
-    
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], format='ISO8601', cache=True)
+
+    # Hour of day straight from the datetime64 buffer (no per-row time objects)
+    ts = df['Timestamp'].values.astype('datetime64[ns]')
+    hours = ((ts - ts.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(np.int8)
+
+    # Light phase is 09:00 to 21:00, dark phase is 21:00 to 09:00
+    light_mask = (hours >= 9) & (hours < 21)
+    light_phase_data = df[light_mask]
+    dark_phase_data = df[~light_mask]
+
     return light_phase_data, dark_phase_data
 
 def main():
@@ -53,12 +76,13 @@ def main():
 
             try:
                 # Read the CSV file
-                df = pd.read_csv(csv_file)
+                df = pd.read_csv(csv_file, dtype=STAGE_DTYPES)
 
                 # Check if 'sleepStage' column exists
                 if 'sleepStage' not in df.columns:
                     print(f"Error: 'sleepStage' column not found in {csv_file}. Skipping this file.")
                     continue
+                df['sleepStage'] = round_stage_codes(df['sleepStage'])
 
                 # Get metadata from the user
                 subject = input("Enter subject: ")
@@ -2,11 +2,32 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 # Set the Seaborn theme
 #sns.set_theme(style="whitegrid")
 
-def create_pie_chart(df, output_dir, filename, title):
+def create_pie_chart(df, output_dir, filename, title, ax):
     # Count the occurrences of each sleep stage
     stage_counts = df['sleepStage'].value_counts()
 
@@ -14,26 +35,28 @@ def create_pie_chart(df, output_dir, filename, title):
     labels = ['Awake', 'NREM', 'REM']
     sizes = [stage_counts.get(1, 0), stage_counts.get(2, 0), stage_counts.get(3, 0)]
 
-    # Plot the pie chart
-    plt.figure(figsize=(8, 6))
-    plt.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, textprops={'fontsize': 18},
-            colors=['#ff9999','#66b3ff','#99ff99'], wedgeprops={'edgecolor': 'black'})
+    # Plot the pie chart on the caller's axes so one figure is reused across files
+    ax.clear()
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, textprops={'fontsize': 18},
+           colors=['#ff9999','#66b3ff','#99ff99'], wedgeprops={'edgecolor': 'black'})
     
     # Increase percentage value font size
-    plt.gca().texts[-3].set_fontsize(16)  # For '%1.1f%%' values
-    plt.title(title, fontsize=22)
+    ax.texts[-3].set_fontsize(16)  # For '%1.1f%%' values
+    ax.set_title(title, fontsize=22)
 
     # Generate output path from the filename
     output_path = os.path.join(output_dir, f"{filename}_sleep_stage_pie_chart.png")
     
     # Save the pie chart as an image
-    plt.savefig(output_path)
-    plt.close()
+    ax.figure.savefig(output_path, pil_kwargs={'compress_level': 1})
     print(f"Pie chart saved to: {output_path}")
 
 def main():
     print("Welcome to the Sleep Stage Pie Chart Generator!")
 
+    # One figure shared by every pie chart drawn in this session
+    fig, ax = plt.subplots(figsize=(8, 6))
+
     # Get CSV file path from the user
     while True:
         csv_file = input("Enter the path of a CSV file (or type 'done' to finish): ")
@@ -48,12 +71,13 @@ def main():
 
             try:
                 # Read the CSV file
-                df = pd.read_csv(csv_file)
+                df = pd.read_csv(csv_file, dtype=STAGE_DTYPES)
 
                 # Check if 'sleepStage' column exists
                 if 'sleepStage' not in df.columns:
                     print(f"Error: 'sleepStage' column not found in {csv_file}. Skipping this file.")
                     continue
+                df['sleepStage'] = round_stage_codes(df['sleepStage'])
 
                 # Ask user for subject, session, recording, and extra info
                 subject = input("Enter subject: ")
@@ -72,7 +96,7 @@ def main():
                 filename = f"{subject}_{session}_{recording}_{extra_info}"
 
                 # Create pie chart for the current file
-                create_pie_chart(df, output_dir, filename, title)
+                create_pie_chart(df, output_dir, filename, title, ax)
 
             except Exception as e:
                 print(f"Error processing {csv_file}: {e}")
@@ -80,5 +104,7 @@ def main():
         else:
             print(f"Error: The file at '{csv_file}' does not exist. Please try again.")
 
+    plt.close(fig)
+
 if __name__ == "__main__":
     main()
@@ -3,45 +3,45 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import ttest_ind
+import sys
+from pathlib import Path
 
-def analyze_and_plot_bout_lengths(input_file, output_file):
-    # Load data
-    df = pd.read_csv(input_file)
 
-    # Assume the CSV has columns: 'Timestamp' and 'sleepStage' (1, 2, or 3)
-    # Convert Timestamp to datetime
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    
-    # Extract time from Timestamp to classify light and dark phases
-    df['time'] = df['Timestamp'].dt.time
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
 
-    # Define light and dark phases
-    light_start, light_end = pd.to_datetime("09:00").time(), pd.to_datetime("21:00").time()
-    
-    # Helper function to classify time as light or dark phase
-    def phase(time):
-        return 'light' if light_start <= time < light_end else 'dark'
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
 
-    # Apply phase classification
-    df['phase'] = df['time'].apply(phase)
 
-    # Function to calculate bout lengths
-    def calculate_bouts(df, stage):
-        # Select data for specific stage
-        df_stage = df[df['sleepStage'] == stage]
-        df_stage['bout'] = (df_stage['sleepStage'] != df_stage['sleepStage'].shift()).cumsum()
-        
-        # Group by 'bout' to calculate lengths
-        bout_lengths = df_stage.groupby(['bout', 'phase']).size().reset_index(name='length')
-        return bout_lengths
+_ensure_repo_root_on_path()
 
-    # Calculate bout lengths for each sleep stage
-    bout_data = []
-    for stage in [1, 2, 3]:
-        bouts = calculate_bouts(df, stage)
-        bouts['sleepStage'] = stage
-        bout_data.append(bouts)
-    bout_lengths_df = pd.concat(bout_data, ignore_index=True)
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
+
+def analyze_and_plot_bout_lengths(input_file, output_file):
+    # Load data
+    # Assume the CSV has columns: 'Timestamp' and 'sleepStage' (1, 2, or 3);
+    # Arrow parses Timestamp to datetime while reading
+    df = pd.read_csv(input_file, engine='pyarrow', dtype=STAGE_DTYPES, parse_dates=['Timestamp'])
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
+    
+    # Classify light (09:00-21:00) and dark phases from the integer hour of day
+    hours = df['Timestamp'].dt.hour.to_numpy()
+    df['phase'] = np.where((hours >= 9) & (hours < 21), 'light', 'dark')
+
+    # Identify bouts once over the whole recording: a new bout starts whenever the stage changes
+    df['bout'] = (df['sleepStage'] != df['sleepStage'].shift()).cumsum()
+
+    # Bout lengths per stage and phase in a single groupby (bouts crossing 09:00/21:00 are split)
+    bout_lengths_df = df.groupby(['bout', 'sleepStage', 'phase']).size().reset_index(name='length')
+    bout_lengths_df = bout_lengths_df[bout_lengths_df['sleepStage'].isin([1, 2, 3])]
 
     # Run t-tests for each sleep stage
     t_test_results = {}
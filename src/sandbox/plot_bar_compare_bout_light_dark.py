@@ -3,36 +3,50 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import ttest_ind
+import sys
+from pathlib import Path
 
-def analyze_and_plot_bout_lengths(input_file, output_file):
-    # Load data
-    df = pd.read_csv(input_file)
 
-    # Assume the CSV has columns: 'Timestamp' and 'sleepStage' (1, 2, or 3)
-    # Convert Timestamp to datetime
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    
-    # Extract time from Timestamp to classify light and dark phases
-    df['time'] = df['Timestamp'].dt.time
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
 
-    # Define light and dark phases
-    light_start, light_end = pd.to_datetime("09:00").time(), pd.to_datetime("21:00").time()
-    
-    # Helper function to classify time as light or dark phase
-    def phase(time):
-        return 'light' if light_start <= time < light_end else 'dark'
 
-    # Apply phase classification
-    df['phase'] = df['time'].apply(phase)
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
+
+def analyze_and_plot_bout_lengths(input_file, output_file):
+    # Load data
+    # Assume the CSV has columns: 'Timestamp' and 'sleepStage' (1, 2, or 3);
+    # Arrow parses Timestamp to datetime while reading
+    df = pd.read_csv(input_file, usecols=['Timestamp', 'sleepStage'], engine='pyarrow',
+                     dtype=STAGE_DTYPES, parse_dates=['Timestamp'])
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
+    
+    # Classify light (09:00-21:00) and dark phases from the integer hour of day
+    hours = df['Timestamp'].dt.hour.to_numpy()
+    df['phase'] = pd.Categorical.from_codes(((hours >= 9) & (hours < 21)).astype(np.int8),
+                                            categories=['dark', 'light'])
 
     # Function to calculate bout lengths regardless of sleep stage
     def calculate_bouts(df):
-        # Identify bouts regardless of sleep stage
-        df['bout'] = (df['sleepStage'] != df['sleepStage'].shift()).cumsum()
-        
-        # Group by 'bout' and 'phase' to calculate bout lengths
-        bout_lengths = df.groupby(['bout', 'phase']).size().reset_index(name='length')
-        return bout_lengths
+        # A new bout starts wherever the sleep stage or the phase changes
+        stage = df['sleepStage'].to_numpy()
+        phase = df['phase'].cat.codes.to_numpy()
+        boundaries = np.flatnonzero(np.r_[True, (stage[1:] != stage[:-1]) | (phase[1:] != phase[:-1])])
+        lengths = np.diff(np.append(boundaries, len(stage)))
+        bout_phase = pd.Categorical.from_codes(phase[boundaries], categories=df['phase'].cat.categories)
+        return pd.DataFrame({'phase': bout_phase, 'length': lengths})
 
     # Calculate bout lengths across all sleep stages
     bout_lengths_df = calculate_bouts(df)
@@ -45,7 +59,16 @@ def analyze_and_plot_bout_lengths(input_file, output_file):
     t_stat, p_val = ttest_ind(light_bouts, dark_bouts, equal_var=False)
 
     # Prepare data for plotting (mean and SEM for each phase)
-    bout_summary = bout_lengths_df.groupby('phase')['length'].agg(['mean', 'sem']).reset_index()
+    # Two phases only, so per-phase sums come straight from np.bincount on the codes
+    phase_codes = bout_lengths_df['phase'].cat.codes.to_numpy()
+    lengths = bout_lengths_df['length'].to_numpy()
+    counts = np.bincount(phase_codes, minlength=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(phase_codes, weights=lengths, minlength=2) / counts
+        sq_dev = np.bincount(phase_codes, weights=(lengths - means[phase_codes]) ** 2, minlength=2)
+        sems = np.sqrt(sq_dev / (counts - 1)) / np.sqrt(counts)
+    bout_summary = pd.DataFrame({'phase': bout_lengths_df['phase'].cat.categories,
+                                 'mean': means, 'sem': sems})
 
     # Plot results
     plt.figure(figsize=(8, 6))
@@ -2,13 +2,32 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
 
-def create_hypnogram(file_path, start_time, end_time):
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(file_path)
 
-    # Ensure 'Timestamp' column is in datetime format
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
+
+def create_hypnogram(file_path, start_time, end_time):
+    # Load the CSV file into a DataFrame; Arrow parses 'Timestamp' to datetime while reading
+    df = pd.read_csv(file_path, engine='pyarrow', dtype=STAGE_DTYPES, parse_dates=['Timestamp'])
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
     
     # Convert start_time and end_time to datetime format
     start_time = pd.to_datetime(start_time)
@@ -30,7 +49,12 @@ def create_hypnogram(file_path, start_time, end_time):
 
     # Plot the hypnogram
     plt.figure(figsize=(16, 3))  # Adjusted figure height to compress the y-axis
-    plt.plot(df_filtered['Minutes'], df_filtered['sleepStage'], color='black', linestyle='-')
+    # Only the run boundaries are needed for a step trace: the first sample of each run
+    # plus the final sample, drawn with steps-post so each level holds until the next run
+    x = df_filtered['Minutes'].to_numpy()
+    stages = df_filtered['sleepStage'].to_numpy()
+    points = np.r_[0, np.flatnonzero(np.diff(stages)) + 1, len(stages) - 1] if len(stages) else []
+    plt.plot(x[points], stages[points], color='black', linestyle='-', drawstyle='steps-post')
 
     # Adjust y-axis limits to reduce space between ticks
     plt.ylim(0.8, 3.2)  # Reduced space between ticks for more compact labels
@@ -1,30 +1,39 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.signal import butter, filtfilt
+from functools import lru_cache
+from scipy.signal import butter, sosfiltfilt, decimate
 from datetime import datetime
 
 def load_eeg_from_pickle(file_path):
     df = pd.read_pickle(file_path)
-    return df['EEG1'].values, df.index
+    # float32 is ample for EEG resolution and halves memory traffic downstream
+    return df['EEG1'].to_numpy(dtype=np.float32), df.index
 
-def bandpass_filter(data, lowcut, highcut, fs, order=2):
+@lru_cache(maxsize=32)
+def _design_bandpass(lowcut, highcut, fs, order):
     nyquist = 0.5 * fs
     low = lowcut / nyquist
     high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-    y = filtfilt(b, a, data)
+    return butter(order, [low, high], btype='band', output='sos')
+
+def bandpass_filter(data, lowcut, highcut, fs, order=2):
+    # Coefficients are memoised: batch runs reuse the same (lowcut, highcut, fs, order)
+    sos = _design_bandpass(lowcut, highcut, fs, order)
+    # scipy filters in float64 internally; the result only feeds 5 s power, so store float32
+    y = sosfiltfilt(sos, data).astype(np.float32)
     return y
 
 def calculate_power(signal, fs, window_size):
-    power = []
     window_samples = window_size * fs
-    for start in range(0, len(signal), window_samples):
-        end = start + window_samples
-        segment = signal[start:end]
-        segment_power = np.sum(segment**2) / len(segment)
-        power.append(segment_power)
-    return power
+    # Contiguous float32 halves the memory traffic of this bandwidth-bound reduction
+    signal = np.ascontiguousarray(signal, dtype=np.float32)
+    if len(signal) == 0:
+        return np.empty(0, dtype=np.float32)
+    starts = np.arange(0, len(signal), window_samples)
+    # Mean square per window; the trailing partial window uses its own length
+    lengths = np.diff(np.append(starts, len(signal)))
+    return np.add.reduceat(signal * signal, starts) / lengths.astype(np.float32)
 
 def plot_power(power, window_size, start_time):
     # Calculate time points excluding last point
@@ -42,18 +51,33 @@ def process_eeg(pickle_file, start_time, range_start, range_end, lowcut, highcut
     # Load EEG data
     eeg_signal, timestamps = load_eeg_from_pickle(pickle_file)
     
-    # Create time index
-    timestamps = pd.date_range(start=start_time, periods=len(eeg_signal), freq=f'{1/fs}S')
-    
-    # Select time range
-    mask = (timestamps >= range_start) & (timestamps <= range_end)
-    eeg_selected = eeg_signal[mask]
+    # Select time range by sample index, inclusive at both ends
+    start_ns = pd.Timestamp(start_time).value
+    first = -((start_ns - pd.Timestamp(range_start).value) * fs // 10**9)
+    last = (pd.Timestamp(range_end).value - start_ns) * fs // 10**9
+    first = max(first, 0)
+    last = min(max(last, -1), len(eeg_signal) - 1)
+    eeg_selected = eeg_signal[first:last + 1]
     
+    # Decimate before filtering: take the largest power-of-two factor that keeps the new
+    # rate at least 8x the high cutoff (512 -> 32 Hz for 1-4 Hz). Bands too high for that
+    # margin fall back to keeping the new Nyquist at least 1.25x the high cutoff (e.g.
+    # 512 -> 256 Hz for 40-100 Hz), where the zero-phase FIR anti-alias filter is still flat
+    factor = 1
+    while fs % (factor * 2) == 0 and fs // (factor * 2) >= 8 * highcut:
+        factor *= 2
+    if factor == 1:
+        while fs % (factor * 2) == 0 and fs // (factor * 2) >= 2.5 * highcut:
+            factor *= 2
+    if factor > 1:
+        eeg_selected = decimate(eeg_selected, factor, ftype='fir', zero_phase=True)
+    fs_ds = fs // factor
+
     # Apply bandpass filter
-    filtered_signal = bandpass_filter(eeg_selected, lowcut, highcut, fs)
+    filtered_signal = bandpass_filter(eeg_selected, lowcut, highcut, fs_ds)
     
     # Calculate power every 10 seconds
-    power = calculate_power(filtered_signal, fs, 5)
+    power = calculate_power(filtered_signal, fs_ds, 5)
     
     # Plot power
     plot_power(power, 5, range_start)
@@ -1,29 +1,40 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.signal import butter, filtfilt
+from functools import lru_cache
+from scipy.signal import butter, sosfiltfilt
 from datetime import datetime
 
 def load_eeg_from_pickle(file_path):
     df = pd.read_pickle(file_path)
-    return df['EEG1'].values, df.index
+    # float32 is ample for EEG resolution and halves memory traffic downstream
+    return df['EEG1'].to_numpy(dtype=np.float32), df.index
 
-def bandpass_filter(data, lowcut, highcut, fs, order=2):
+@lru_cache(maxsize=32)
+def _design_bandpass(lowcut, highcut, fs, order):
     nyquist = 0.5 * fs
     low = lowcut / nyquist
     high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-    y = filtfilt(b, a, data)
+    return butter(order, [low, high], btype='band', output='sos')
+
+def bandpass_filter(data, lowcut, highcut, fs, order=2):
+    # Coefficients are memoised: batch runs reuse the same (lowcut, highcut, fs, order)
+    sos = _design_bandpass(lowcut, highcut, fs, order)
+    # scipy filters in float64 internally; the result only feeds 10 s power, so store float32
+    y = sosfiltfilt(sos, data).astype(np.float32)
     return y
 
 def calculate_power(signal, fs, window_size):
-    power = []
     window_samples = window_size * fs
-    for start in range(0, len(signal), window_samples):
-        end = start + window_samples
-        segment = signal[start:end]
-        segment_power = np.sum(segment**2) / len(segment)
-        power.append(segment_power)
+    signal = np.asarray(signal)
+    # Full windows as rows of one contiguous block; einsum squares and sums in a single pass
+    n = len(signal) // window_samples
+    seg = signal[:n * window_samples].reshape(n, window_samples)
+    power = np.einsum('ij,ij->i', seg, seg) / window_samples
+    # The trailing partial window (if any) is averaged over its own length
+    tail = signal[n * window_samples:]
+    if len(tail):
+        power = np.append(power, np.dot(tail, tail) / len(tail))
     return power
 
 def plot_power_ratio(power, window_size, start_time):
@@ -42,12 +53,13 @@ def process_eeg_ratio(pickle_file, start_time, range_start, range_end, lowcut1,
     # Load EEG data
     eeg_signal, timestamps = load_eeg_from_pickle(pickle_file)
     
-    # Create time index
-    timestamps = pd.date_range(start=start_time, periods=len(eeg_signal), freq=f'{1/fs}S')
-    
-    # Select time range
-    mask = (timestamps >= range_start) & (timestamps <= range_end)
-    eeg_selected = eeg_signal[mask]
+    # Select time range by sample index, inclusive at both ends
+    start_ns = pd.Timestamp(start_time).value
+    first = -((start_ns - pd.Timestamp(range_start).value) * fs // 10**9)
+    last = (pd.Timestamp(range_end).value - start_ns) * fs // 10**9
+    first = max(first, 0)
+    last = min(max(last, -1), len(eeg_signal) - 1)
+    eeg_selected = eeg_signal[first:last + 1]
     
     # Apply bandpass filters for both frequency ranges
     filtered_signal1 = bandpass_filter(eeg_selected, lowcut1, highcut1, fs)
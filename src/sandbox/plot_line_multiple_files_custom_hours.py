@@ -2,7 +2,6 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 from scipy.ndimage import gaussian_filter1d
-from matplotlib.patches import Rectangle
 import sys
 from pathlib import Path
 
@@ -83,51 +82,38 @@ def plot_sleep_stages(files, subjects):
             print(f"File {file} is missing required columns.")
             continue
 
-        # Adjust ZT to create unique x-axis values for continuous cycles
+        # Adjust ZT to create unique x-axis values for continuous cycles: every
+        # decrease in ZT starts a new 24 h cycle
         max_zt = 24
-        unique_x_values = []
-        last_zt = None
-        cycle = 0
-
-        for zt in data['ZT']:
-            if last_zt is not None and zt < last_zt:
-                cycle += 1
-            unique_x_values.append(zt + cycle * max_zt)
-            last_zt = zt
-
-        data['ZT_Adjusted'] = unique_x_values
+        zt = data['ZT'].to_numpy()
+        wraps = np.concatenate([[0], (np.diff(zt) < 0).astype(np.int32)])
+        data['ZT_Adjusted'] = zt + wraps.cumsum() * max_zt
 
         # Update min and max ZT_Adjusted if data exists
         if not data['ZT_Adjusted'].empty:
             min_zt_adjusted = min(min_zt_adjusted, data['ZT_Adjusted'].min())
             max_zt_adjusted = max(max_zt_adjusted, data['ZT_Adjusted'].max())
 
-        # Smooth the data with Gaussian filter (sigma=1)
-        smoothed_data = {
-            stage: gaussian_filter1d(data[stage], sigma=1)
+        # Smooth the data with Gaussian filter (sigma=1); the stages are stacked as rows
+        # so the kernel is built and applied in a single call
+        stages = data[stage_columns].to_numpy().T
+        smoothed_data = dict(zip(stage_columns, gaussian_filter1d(stages, sigma=1, axis=1)))
+
+        # Identify gaps in the ZT sequence once and insert NaN after each gap
+        zt_adjusted = data['ZT_Adjusted'].to_numpy(dtype=float)
+        gap_idx = np.flatnonzero(np.diff(zt_adjusted) > 1) + 1
+        adjusted = np.insert(zt_adjusted, gap_idx, np.nan)
+
+        adjusted_values = np.column_stack([
+            np.insert(smoothed_data[stage].astype(float), gap_idx, np.nan)
             for stage in stage_columns
-        }
-
-        # Identify gaps in the ZT sequence and insert NaN
-        adjusted = [data['ZT_Adjusted'].iloc[0]]
-        for i in range(1, len(data)):
-            if data['ZT_Adjusted'].iloc[i] - data['ZT_Adjusted'].iloc[i - 1] > 1:
-                # Insert NaN for the gap
-                adjusted.append(np.nan)
-            adjusted.append(data['ZT_Adjusted'].iloc[i])
-
-        for stage in stage_columns:
-            values = smoothed_data[stage].tolist()
-            adjusted_values = [values[0]]
-            for i in range(1, len(values)):
-                if data['ZT_Adjusted'].iloc[i] - data['ZT_Adjusted'].iloc[i - 1] > 1:
-                    # Insert NaN for the gap
-                    adjusted_values.append(np.nan)
-                adjusted_values.append(values[i])
-
-            # Plot the adjusted data
-            ax1.plot(adjusted, adjusted_values, linestyle=line_styles[idx % len(line_styles)], 
-                     color=colors[stage], linewidth=1, label=f"{stage_labels[stage]} ({subject})")
+        ])
+
+        # Plot the adjusted data: one call per file draws a line per stage column
+        lines = ax1.plot(adjusted, adjusted_values, linestyle=line_styles[idx % len(line_styles)], 
+                         linewidth=1, label=[f"{stage_labels[stage]} ({subject})" for stage in stage_columns])
+        for line, stage in zip(lines, stage_columns):
+            line.set_color(colors[stage])
 
     # Handle case where no valid data exists
     if max_zt_adjusted == -float('inf') or min_zt_adjusted == float('inf'):
@@ -140,13 +126,11 @@ def plot_sleep_stages(files, subjects):
     bar_height = (y_max - y_min) * 0.05  # Height of the bar as 5% of the y-axis range
     bar_y_start = y_min - bar_height  # Position the bar just below the visible range
 
-    for i in range(total_cycles):
-        start = i * 12
-        end = (i + 1) * 12
-        color = 'orange' if i % 2 == 0 else 'grey'
-
-        # Add the rectangle for the cycle bar
-        ax1.add_patch(Rectangle((start, bar_y_start), width=end - start, height=bar_height, color=color, alpha=0.6))
+    # One collection per colour instead of a Rectangle patch per 12-hour cycle
+    cycle_starts = np.arange(total_cycles) * 12
+    for parity, color in ((0, 'orange'), (1, 'grey')):
+        spans = [(start, 12) for start in cycle_starts[parity::2]]
+        ax1.broken_barh(spans, (bar_y_start, bar_height), color=color, alpha=0.6)
 
     # Adjust the y-axis limits to include the cycle bar
     ax1.set_ylim(bar_y_start, y_max)
@@ -5,14 +5,36 @@ from datetime import timedelta
 import glob
 import numpy as np
 from scipy.stats import pearsonr
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 def analyze_sleep_cycles(file_path):
     """
     Analyze sleep cycles from a single CSV file.
     Returns DataFrame with start_time, end_time, and cycle_length (in minutes).
     """
-    df = pd.read_csv(file_path)
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    df = pd.read_csv(file_path, dtype=STAGE_DTYPES)
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], format='ISO8601', cache=True)
     
     rem_ends = []
     for i in range(len(df)-1):
@@ -62,13 +84,13 @@ def process_multiple_files(folder_path):
     Returns a combined DataFrame of cycle lengths.
     """
     all_files = glob.glob(f"{folder_path}/*.csv")
-    combined_data = pd.DataFrame()
+    results = []
     
     for file in all_files:
-        df = analyze_sleep_cycles(file)
-        combined_data = pd.concat([combined_data, df], ignore_index=True)
+        results.append(analyze_sleep_cycles(file))
     
-    return combined_data
+    # Concatenate once rather than re-copying the running frame on every file
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
 
 def convert_to_zt(start_time):
     """
@@ -0,0 +1,31 @@
+"""Central decoding of the sleepStage column for all scoring CSV readers.
+
+Stage codes are 1 (Wake), 2 (NREM) and 3 (REM), but scoring files can hold them
+as floats or leave them blank. Read the column with ``STAGE_DTYPES`` and decode it
+with ``round_stage_codes`` (or ``stage_code_array`` where blanks are an error) so
+every script treats the same file the same way.
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+# float32 holds every stage code exactly and keeps blank stages as NaN
+STAGE_DTYPES: Dict[str, str] = {"sleepStage": "float32"}
+
+
+def round_stage_codes(stages: pd.Series) -> pd.Series:
+    """Round stage codes to the nearest integer, keeping blank stages as NaN."""
+
+    return np.rint(stages.astype(np.float32))
+
+
+def stage_code_array(stages: pd.Series) -> np.ndarray:
+    """Return stage codes as an int8 array, rejecting blank stages."""
+
+    # A plain int8 cast turns blanks into 0 and truncates fractional codes
+    if stages.isna().any():
+        raise ValueError("The 'sleepStage' column has blank values.")
+    return np.rint(stages.to_numpy(dtype=float)).astype(np.int8)
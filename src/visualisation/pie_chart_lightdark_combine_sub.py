@@ -1,7 +1,10 @@
 import os
 import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
@@ -23,6 +26,7 @@ def _ensure_repo_root_on_path():
 _ensure_repo_root_on_path()
 
 from src.stage_colors import get_stage_palette
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 # Match publication styling used by 24 h line plots
 plt.rcParams.update({
@@ -44,10 +48,12 @@ STAGE_CODES = [1, 2, 3]
 STAGE_LABELS = ['Wake', 'NREM', 'REM']
 STAGE_PALETTE = get_stage_palette(STAGE_LABELS)
 
-def create_pie_chart(stage_counts, output_path, title):
+def create_pie_chart(stage_counts, output_path, title, ax, dpi=300):
     sizes = [stage_counts.get(code, 0) for code in STAGE_CODES]
 
-    fig, ax = plt.subplots(figsize=(6, 6))
+    # Draw on the caller's axes so one figure is reused across charts
+    fig = ax.figure
+    ax.clear()
     wedges, texts, autotexts = ax.pie(
         sizes,
         labels=STAGE_LABELS,
@@ -67,7 +73,9 @@ def create_pie_chart(stage_counts, output_path, title):
     fig.tight_layout()
 
     if output_path:
-        fig.savefig(output_path, dpi=600, bbox_inches='tight')
+        # matplotlib already encodes PNGs through Pillow; a low zlib level keeps
+        # most of the size saving at a fraction of the default level-6 CPU cost
+        fig.savefig(output_path, dpi=dpi, bbox_inches='tight', pil_kwargs={'compress_level': 1})
         if output_path.endswith('.png'):
             pdf_path = output_path.replace('.png', '.pdf')
         else:
@@ -75,26 +83,56 @@ def create_pie_chart(stage_counts, output_path, title):
         fig.savefig(pdf_path, format='pdf', bbox_inches='tight')
         print(f"Pie chart saved to: {output_path} and {pdf_path}")
 
-    plt.close(fig)
-
 def aggregate_phases(df):
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    
-    # Filter for light phase (09:00 to 21:00)
-    light_phase_data = df[(df['Timestamp'].dt.time >= pd.Timestamp('09:00').time()) & 
-                          (df['Timestamp'].dt.time < pd.Timestamp('21:00').time())]
-    
-    # Filter for dark phase (21:00 to 09:00)
-    dark_phase_data = df[(df['Timestamp'].dt.time >= pd.Timestamp('21:00').time()) | 
-                         (df['Timestamp'].dt.time < pd.Timestamp('09:00').time())]
-    
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], format='ISO8601', cache=True)
+
+    # Hour of day straight from the datetime64 buffer (no per-row time objects)
+    ts = df['Timestamp'].values.astype('datetime64[ns]')
+    hours = ((ts - ts.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(np.int8)
+
+    # Light phase is 09:00 to 21:00, dark phase is 21:00 to 09:00
+    light_mask = (hours >= 9) & (hours < 21)
+    light_phase_data = df[light_mask]
+    dark_phase_data = df[~light_mask]
+
     return light_phase_data, dark_phase_data
 
+def process_file(full_path):
+    """Return (light, dark) stage Counters for one CSV file, or None if it cannot be used."""
+    csv_file = os.path.basename(full_path)
+    try:
+        # Read only the two columns used; the callable keeps a missing column
+        # from raising so the friendlier check below still reports it
+        df = pd.read_csv(
+            full_path,
+            usecols=lambda column: column in {'Timestamp', 'sleepStage'},
+            dtype=STAGE_DTYPES,
+        )
+
+        # Check if required columns exist
+        if 'sleepStage' not in df.columns or 'Timestamp' not in df.columns:
+            print(f"Error: Required columns not found in {csv_file}. Skipping this file.")
+            return None
+        # Blank stages stay NaN and drop out of the counts; the file's other rows still count
+        df['sleepStage'] = round_stage_codes(df['sleepStage'])
+
+        print(f"Processing: {csv_file}")
+        # Aggregate data for light and dark phases
+        light_phase_data, dark_phase_data = aggregate_phases(df)
+
+        return (Counter(light_phase_data['sleepStage'].value_counts().to_dict()),
+                Counter(dark_phase_data['sleepStage'].value_counts().to_dict()))
+
+    except Exception as e:
+        print(f"Error processing {csv_file}: {e}")
+        return None
+
 def main():
     print("Welcome to the Sleep Stage Pie Chart Generator!")
 
-    all_light_phase_data = pd.DataFrame()
-    all_dark_phase_data = pd.DataFrame()
+    # Only per-stage counts are needed, so accumulate those instead of the rows
+    light_stage_counts = Counter()
+    dark_stage_counts = Counter()
 
     # Get directory containing CSV files
     input_dir = input("Enter the directory containing CSV files: ")
@@ -110,31 +148,18 @@ def main():
 
     print(f"Found {len(csv_files)} CSV files to process...")
 
-    # Process each CSV file
-    for csv_file in csv_files:
-        full_path = os.path.join(input_dir, csv_file)
-        try:
-            # Read the CSV file
-            df = pd.read_csv(full_path)
-
-            # Check if required columns exist
-            if 'sleepStage' not in df.columns or 'Timestamp' not in df.columns:
-                print(f"Error: Required columns not found in {csv_file}. Skipping this file.")
+    # Process the CSV files in parallel; each worker returns only its stage counts
+    full_paths = [os.path.join(input_dir, csv_file) for csv_file in csv_files]
+    with ProcessPoolExecutor() as executor:
+        for counts in executor.map(process_file, full_paths):
+            if counts is None:
                 continue
-
-            print(f"Processing: {csv_file}")
-            # Aggregate data for light and dark phases
-            light_phase_data, dark_phase_data = aggregate_phases(df)
-
-            # Combine with existing data
-            all_light_phase_data = pd.concat([all_light_phase_data, light_phase_data], ignore_index=True)
-            all_dark_phase_data = pd.concat([all_dark_phase_data, dark_phase_data], ignore_index=True)
-
-        except Exception as e:
-            print(f"Error processing {csv_file}: {e}")
+            light_counts, dark_counts = counts
+            light_stage_counts.update(light_counts)
+            dark_stage_counts.update(dark_counts)
 
     # Generate combined pie charts if data is available
-    if not all_light_phase_data.empty and not all_dark_phase_data.empty:
+    if light_stage_counts and dark_stage_counts:
         output_dir = input("Enter the output directory for the pie charts: ")
         if not os.path.exists(output_dir):
             print(f"Error: The directory '{output_dir}' does not exist. Please create it and try again.")
@@ -146,8 +171,10 @@ def main():
         light_filename = os.path.join(output_dir, "combined_light_phase_pie_chart.png")
         dark_filename = os.path.join(output_dir, "combined_dark_phase_pie_chart.png")
 
-        create_pie_chart(all_light_phase_data['sleepStage'].value_counts(), light_filename, light_title)
-        create_pie_chart(all_dark_phase_data['sleepStage'].value_counts(), dark_filename, dark_title)
+        fig, ax = plt.subplots(figsize=(6, 6))
+        create_pie_chart(light_stage_counts, light_filename, light_title, ax)
+        create_pie_chart(dark_stage_counts, dark_filename, dark_title, ax)
+        plt.close(fig)
     else:
         print("No valid data was found to generate pie charts.")
 
@@ -1,12 +1,30 @@
-import csv
-from datetime import datetime, timedelta
-from scipy.stats import sem
-from statsmodels.stats.anova import AnovaRM
-from statsmodels.stats.multicomp import MultiComparison
+from concurrent.futures import ProcessPoolExecutor
+import pingouin as pg
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import re
+from pathlib import Path
+import sys
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 # Shared plotting style
 plt.rcParams.update({
@@ -39,65 +57,44 @@ def _normalize_subject_label(label):
 def calculate_bout_durations_from_csv(file_path):
     """
     Calculate bout durations for each sleep stage based on continuous values from a CSV file.
+    Results are cached next to the CSV as a Parquet sidecar and reused while it is newer than the CSV.
     """
-    def calculate_zt(timestamp):
-        """
-        Calculate the ZT (Zeitgeber Time) based on the timestamp.
-        """
-        base_time = datetime.strptime("09:00:00", "%H:%M:%S")
-        # Remove the microseconds part by splitting at the dot if present
-        time_str = timestamp.split()[1].split('.')[0]
-        current_time = datetime.strptime(time_str, "%H:%M:%S")
-        delta = current_time - base_time
-
-        if delta.days < 0:  # Handle times past midnight
-            delta += timedelta(days=1)
-
-        zt = (delta.total_seconds() / 3600) % 24
-        return zt
-
-    # Read the data from the CSV
-    with open(file_path, mode='r') as file:
-        reader = csv.DictReader(file)
-        data = [(row['Timestamp'], int(row['sleepStage'])) for row in reader]
-
-    if not data:
-        return []
-
-    # Initialize variables
-    bouts = []
-    start_timestamp = data[0][0]  # Start timestamp of the current bout
-    current_stage = data[0][1]   # Current sleep stage
-    bout_length = 1              # Length of the current bout
-
-    # Iterate through the data starting from the second element
-    for i in range(1, len(data)):
-        timestamp, sleep_stage = data[i]
-
-        if sleep_stage == current_stage:
-            # Increment bout length if the stage is continuous
-            bout_length += 1
-        else:
-            # Append the bout as a dictionary
-            bouts.append({
-                'Timestamp': start_timestamp,
-                'Duration': bout_length,
-                'sleepStage': current_stage,
-                'ZT': calculate_zt(start_timestamp)
-            })
-
-            # Reset for the next bout
-            start_timestamp = timestamp
-            current_stage = sleep_stage
-            bout_length = 1
-
-    # Add the final bout to the result
-    bouts.append({
-        'Timestamp': start_timestamp,
-        'Duration': bout_length,
-        'sleepStage': current_stage,
-        'ZT': calculate_zt(start_timestamp)
+    csv_path = Path(file_path)
+    cache_path = csv_path.with_suffix('.zt_bouts.parquet')
+    if cache_path.exists() and cache_path.stat().st_mtime >= csv_path.stat().st_mtime:
+        return pd.read_parquet(cache_path)
+
+    # Read only the columns needed for bout detection
+    df = pd.read_csv(file_path, usecols=['Timestamp', 'sleepStage'], engine='pyarrow',
+                     dtype=STAGE_DTYPES, parse_dates=['Timestamp'])
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
+
+    if df.empty:
+        return pd.DataFrame(columns=['Timestamp', 'Duration', 'sleepStage', 'ZT'])
+
+    # A bout starts at the first row and wherever the sleep stage changes
+    stages = df['sleepStage'].to_numpy()
+    starts = np.r_[0, np.flatnonzero(np.diff(stages)) + 1]
+    durations = np.diff(np.r_[starts, len(stages)])
+    start_timestamps = df['Timestamp'].to_numpy()[starts]
+
+    # ZT with 09:00:00 as ZT 0, from whole epoch seconds (fractions dropped)
+    epoch_seconds = start_timestamps.astype('datetime64[s]').astype(np.int64)
+    zt = ((epoch_seconds - 9 * 3600) % 86400) / 3600
+
+    bouts = pd.DataFrame({
+        'Timestamp': start_timestamps,
+        'Duration': durations,
+        'sleepStage': stages[starts],
+        'ZT': zt
     })
+    # Blank stages break runs but are not bouts themselves
+    bouts = bouts[bouts['sleepStage'].notna()].reset_index(drop=True)
+
+    try:
+        bouts.to_parquet(cache_path, index=False)
+    except OSError as e:
+        print(f"Could not write bout cache {cache_path}: {e}")
 
     return bouts
 
@@ -114,40 +111,33 @@ def analyze_relationship_with_bar_charts_and_repeated_measures_anova(bout_data,
     cmap = plt.get_cmap('tab10')
     subject_palette = {subject: cmap(idx % cmap.N) for idx, subject in enumerate(ordered_subjects)}
 
-    sleep_stages = sorted(set(bout['sleepStage'] for subject_data in bout_data for bout in subject_data))
-
-    # Group ZT into 3-hour blocks
-    def zt_to_block(zt):
-        return int(zt // 3) * 3
+    sleep_stages = sorted(set().union(*(subject_data['sleepStage'].unique() for subject_data in bout_data)))
 
     for stage in sleep_stages:
         # Map sleep stage to name
         stage_name = sleep_stage_map.get(stage, f"Stage {stage}")
         
-        zt_blocks = []
-        durations = []
-        subjects = []
-
         # Collect data for plotting and analysis
-        for idx, subject_data in enumerate(bout_data):
-            stage_data = [bout for bout in subject_data if bout['sleepStage'] == stage]
-            zt_blocks.extend(zt_to_block(bout['ZT']) for bout in stage_data)
-            durations.extend(bout['Duration'] for bout in stage_data)
-            subjects.extend([normalized_subjects[idx]] * len(stage_data))
+        stage_bouts = [subject_data[subject_data['sleepStage'] == stage] for subject_data in bout_data]
 
-        # Create a DataFrame for analysis
+        # Create a DataFrame for analysis, with ZT grouped into 3-hour blocks
         plot_data = pd.DataFrame({
-            'Subject': subjects,
-            'ZT Block': zt_blocks,
-            'Duration': durations
+            'Subject': np.repeat(normalized_subjects, [len(stage_data) for stage_data in stage_bouts]),
+            'ZT Block': np.concatenate([(stage_data['ZT'].to_numpy() // 3).astype(int) * 3 for stage_data in stage_bouts]),
+            'Duration': np.concatenate([stage_data['Duration'].to_numpy() for stage_data in stage_bouts])
         })
 
         # Ensure all ZT blocks are represented
         all_blocks = range(0, 24, 3)
-        grouped_data = plot_data.groupby(['Subject', 'ZT Block'])['Duration'].mean().unstack(fill_value=0)
+        block_means = plot_data.groupby(['Subject', 'ZT Block'])['Duration'].mean().unstack()
+        grouped_data = block_means.fillna(0)
 
         # Bar chart for mean duration per ZT block
-        summary_data = plot_data.groupby('ZT Block')['Duration'].agg(['mean', sem]).reindex(all_blocks, fill_value=0)
+        block_durations = plot_data.groupby('ZT Block')['Duration']
+        summary_data = pd.DataFrame({
+            'mean': block_durations.mean(),
+            'sem': block_durations.std() / np.sqrt(block_durations.count())
+        }).reindex(all_blocks, fill_value=0)
         summary_data['ZT Block'] = summary_data.index
 
         fig, ax = plt.subplots(figsize=(10, 6))
@@ -156,18 +146,12 @@ def analyze_relationship_with_bar_charts_and_repeated_measures_anova(bout_data,
         colors = [light_color if block < 12 else dark_color for block in all_blocks]
         ax.bar(summary_data['ZT Block'], summary_data['mean'], color=colors, width=2.5, align='center')
 
-        # Plot mean for each subject (use a line or different markers)
-        for idx, subject_data in enumerate(bout_data):
-            subject_stage_data = [bout for bout in subject_data if bout['sleepStage'] == stage]
-            subject_zt_blocks = [zt_to_block(bout['ZT']) for bout in subject_stage_data]
-            subject_durations = [bout['Duration'] for bout in subject_stage_data]
-            subject_label = normalized_subjects[idx]
-
-            # Calculate the mean for each subject per ZT block
-            subject_means = [np.mean([d for z, d in zip(subject_zt_blocks, subject_durations) if z == block]) for block in all_blocks]
-
-            # Plot mean for each subject with specified colors
-            ax.plot(all_blocks, subject_means, marker='o', linestyle='-', alpha=0.5, color=subject_palette[subject_label], linewidth=1.2, markersize=4)
+        # Plot mean for each subject (use a line or different markers); blocks
+        # without bouts stay NaN so the line breaks there
+        subject_means = block_means.reindex(index=normalized_subjects, columns=list(all_blocks))
+        for subject_label in normalized_subjects:
+            ax.plot(all_blocks, subject_means.loc[subject_label].to_numpy(), marker='o', linestyle='-', alpha=0.5,
+                    color=subject_palette[subject_label], linewidth=1.2, markersize=4)
 
         # Title and labels
         ax.set_title(stage_name, fontsize=22, pad=20)
@@ -191,34 +175,34 @@ def analyze_relationship_with_bar_charts_and_repeated_measures_anova(bout_data,
         fig.savefig(output_png, dpi=600, bbox_inches='tight')
         output_pdf = output_png[:-4] + '.pdf'
         fig.savefig(output_pdf, dpi=600, bbox_inches='tight')
-        plt.show()
         plt.close(fig)
 
         # Repeated measures ANOVA
         melted_data = grouped_data.reset_index().melt(id_vars='Subject', var_name='ZT_Block', value_name='Duration')
         melted_data['ZT_Block'] = melted_data['ZT_Block'].astype(str)  # Ensure ZT Block is categorical
-        anova_model = AnovaRM(melted_data, depvar='Duration', subject='Subject', within=['ZT_Block'])
-        anova_result = anova_model.fit()
+        anova_result = pg.rm_anova(data=melted_data, dv='Duration', within='ZT_Block', subject='Subject', detailed=True)
         print(f"{stage_name} Repeated Measures ANOVA:")
         print(anova_result)
 
         # Post-hoc pairwise comparisons
-        mc = MultiComparison(melted_data['Duration'], melted_data['ZT_Block'])
-        tukey_result = mc.tukeyhsd()
+        tukey_result = pg.pairwise_tukey(data=melted_data, dv='Duration', between='ZT_Block')
         print(f"Tukey HSD Post-hoc Test ({stage_name}):")
-        print(tukey_result.summary())
+        print(tukey_result)
 
 
 # Example usage:
-file_paths = [
-    "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-007_ses-01_recording-01_time-0-70.5h_1Hz.csv",
-    "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-010_ses-01_recording-01_time-0-69h_1Hz.csv",
-    "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-011_ses-01_recording-01_time-0-72h_1Hz.csv",
-    "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-015_ses-01_recording-01_time-0-49h_1Hz_stitched.csv",
-    "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-016_ses-02_recording-01_time-0-91h_1Hz.csv",
-    "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-017_ses-01_recording-01_time-0-98h_1Hz.csv"    
-]  # Add more file paths as needed
-subject_labels = ["sub-007", "sub-010", "sub-011", "sub-015", "sub-016", "sub-017"]
-
-all_bout_data = [calculate_bout_durations_from_csv(file_path) for file_path in file_paths]
-analyze_relationship_with_bar_charts_and_repeated_measures_anova(all_bout_data, subject_labels)
+if __name__ == "__main__":
+    file_paths = [
+        "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-007_ses-01_recording-01_time-0-70.5h_1Hz.csv",
+        "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-010_ses-01_recording-01_time-0-69h_1Hz.csv",
+        "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-011_ses-01_recording-01_time-0-72h_1Hz.csv",
+        "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-015_ses-01_recording-01_time-0-49h_1Hz_stitched.csv",
+        "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-016_ses-02_recording-01_time-0-91h_1Hz.csv",
+        "/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/automated_state_annotationoutput_sub-017_ses-01_recording-01_time-0-98h_1Hz.csv"    
+    ]  # Add more file paths as needed
+    subject_labels = ["sub-007", "sub-010", "sub-011", "sub-015", "sub-016", "sub-017"]
+
+    # Files are independent, so parse them in parallel worker processes
+    with ProcessPoolExecutor() as executor:
+        all_bout_data = list(executor.map(calculate_bout_durations_from_csv, file_paths))
+    analyze_relationship_with_bar_charts_and_repeated_measures_anova(all_bout_data, subject_labels)
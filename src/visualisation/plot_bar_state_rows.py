@@ -21,6 +21,7 @@ def _ensure_repo_root_on_path():
 _ensure_repo_root_on_path()
 
 from src.stage_colors import get_stage_color
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 # File: /Users/Volkan/Repos/sleep-profile/src/plot_bar_state_rows.py
 
 # Default output location for saved plots
@@ -44,9 +45,10 @@ plt.rcParams.update({
 
 def plot_sleep_stages(csv_file, start_time, end_time, save_path=None):
     # Read and process CSV
-    df = pd.read_csv(csv_file)
+    df = pd.read_csv(csv_file, engine='pyarrow', dtype=STAGE_DTYPES)
     if 'sleepStage' not in df.columns or 'Timestamp' not in df.columns:
         raise ValueError("CSV file must contain 'sleepStage' and 'Timestamp' columns")
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
     
     df['Timestamp'] = pd.to_datetime(df['Timestamp'])
     df = df[(df['Timestamp'] >= start_time) & (df['Timestamp'] <= end_time)]
@@ -83,16 +85,16 @@ def plot_sleep_stages(csv_file, start_time, end_time, save_path=None):
         2: get_stage_color('NREM'),
         3: get_stage_color('REM'),
     }
-    y_pos = 0
-    total_length = 0
-    for _, row in stage_info.iterrows():
-        color = colors.get(row['plot_stage'], '#999999')
-            
-        ax.broken_barh([(y_pos, row['length'])], 
-                      (row['plot_position'] - 0.1, 0.25),
-                      facecolors=color)
-        y_pos += row['length']
-        total_length = y_pos  # Keep track of total length
+    # Runs are laid end to end, so each bar starts where the previous one ended
+    stage_info['x_start'] = stage_info['length'].cumsum() - stage_info['length']
+    total_length = stage_info['length'].sum()  # Keep track of total length
+
+    # One broken_barh collection per plotted stage instead of one per run
+    for plot_stage, runs in stage_info.groupby('plot_stage'):
+        color = colors.get(plot_stage, '#999999')
+        ax.broken_barh(list(zip(runs['x_start'], runs['length'])),
+                       (runs['plot_position'].iloc[0] - 0.1, 0.25),
+                       facecolors=color)
     
     # Set x-axis limits to cover full width
     ax.set_xlim(0, total_length)
@@ -24,6 +24,7 @@ def _ensure_repo_root_on_path():
 _ensure_repo_root_on_path()
 
 from src.stage_colors import get_stage_color
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 plt.rcParams.update({
     'font.family': 'Arial',
@@ -65,25 +66,23 @@ def plot_average_power_spectra(eeg_files, stage_files, channel, sampling_rate=51
             eeg_data = pickle.load(f)
 
         print(f"Loading sleep stage data from {stage_file}...")
-        stages_data = pd.read_csv(stage_file)
+        # Only the stage labels are used; skip parsing Timestamp and any signal columns
+        stages_data = pd.read_csv(stage_file, usecols=['sleepStage'], dtype=STAGE_DTYPES)
 
         if channel not in eeg_data.columns:
             raise ValueError(f"Channel '{channel}' not found in EEG data.")
 
         # Extract the relevant channel and sleep stages
         eeg_signal = eeg_data[channel].values
-        sleep_stages = stages_data['sleepStage'].values
+        sleep_stages = round_stage_codes(stages_data['sleepStage']).to_numpy()
 
         # Verify that EEG signal and stages align
         if len(eeg_signal) != len(sleep_stages):
             raise ValueError("EEG signal and sleep stage scoring lengths do not match.")
 
-        renamed_stages = np.vectorize(stage_mapping.get)(sleep_stages)
-
-        for stage in stage_mapping.values():
-            # Extract data for the current sleep stage
-            stage_indices = np.where(renamed_stages == stage)[0]
-            stage_signal = eeg_signal[stage_indices]
+        for stage_code, stage in stage_mapping.items():
+            # Extract data for the current sleep stage; blank stages match no stage code
+            stage_signal = eeg_signal[sleep_stages == stage_code]
 
             # Compute power spectrum using NeuroDSP's compute_spectrum
             freqs, power = compute_spectrum(stage_signal, fs=sampling_rate, method='welch', nperseg=sampling_rate * 2)
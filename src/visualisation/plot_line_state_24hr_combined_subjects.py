@@ -41,7 +41,7 @@ plt.rcParams.update({
 
 def plot_combined_sleep_data(input_file, output_file):
     # Load the combined CSV file with all subjects' data
-    df = pd.read_csv(input_file)
+    df = pd.read_csv(input_file, engine='pyarrow')
 
     # Ensure data is sorted by ZT for proper plotting
     df = df.sort_values(by='ZT')
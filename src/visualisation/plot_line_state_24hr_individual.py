@@ -42,7 +42,7 @@ plt.rcParams.update({
 
 def plot_combined_sleep_data(input_file, output_file):
     # Load the combined CSV file with all subjects' data
-    df = pd.read_csv(input_file)
+    df = pd.read_csv(input_file, engine='pyarrow')
 
     # Ensure data is sorted by ZT for proper plotting
     df = df.sort_values(by='ZT')
@@ -65,20 +65,22 @@ def plot_combined_sleep_data(input_file, output_file):
     subject_palette = {subj: cmap(idx % cmap.N) for idx, subj in enumerate(subjects)}
     line_styles = ['--', ':', '-.', (0, (3, 2))]
 
+    # One wide ZT x (stage, subject) table so each stage's subject lines come from a single plot call
+    subject_wide = df.pivot_table(index='ZT', columns='subject', values=sleep_stages)
+
     fig, axes = plt.subplots(len(sleep_stages), 1, figsize=(14, 8), sharex=True)
 
     for ax, stage in zip(axes, sleep_stages):
-        # Plot individual subjects with Matplotlib
-        for idx, subject in enumerate(subjects):
-            subject_data = df[df['subject'] == subject]
-            ax.plot(
-                subject_data['ZT'],
-                subject_data[stage],
-                color=subject_palette[subject],
-                linewidth=0.8,
-                linestyle=line_styles[idx % len(line_styles)],
-                alpha=0.35
-            )
+        # Plot individual subjects with Matplotlib: one column (line) per subject
+        subject_lines = ax.plot(
+            subject_wide.index,
+            subject_wide[stage][subjects].to_numpy(),
+            linewidth=0.8,
+            alpha=0.35
+        )
+        for idx, (line, subject) in enumerate(zip(subject_lines, subjects)):
+            line.set_color(subject_palette[subject])
+            line.set_linestyle(line_styles[idx % len(line_styles)])
 
         # Overlay mean and SEM for this stage
         ax.plot(mean_df.index, mean_df[stage], color=stage_colors[stage], linewidth=3, label='Mean')
@@ -1,10 +1,30 @@
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 import glob
 import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 import re
 from pathlib import Path
+import sys
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 plt.rcParams.update({
     'font.family': 'Arial',
@@ -21,43 +41,48 @@ plt.rcParams.update({
     'ps.fonttype': 42
 })
 
-# List of CSV file paths
-csv_files = glob.glob('/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/*.csv')
+def _subject_sort_key(label):
+    match = re.search(r"\d+", str(label))
+    return int(match.group()) if match else float('inf')
 
-# List to store all bout durations from all files
-all_bout_durations = []
 
-for file in csv_files:
-    df = pd.read_csv(file)
-    
-    # Convert Timestamp column to datetime format
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    
-    # Round the numbers in the sleepStage column to the nearest integer
-    df['sleepStage'] = df['sleepStage'].round().astype(int)
-    
-    # Create a new column to track changes in sleep stage
-    df['sleepStageChange'] = df['sleepStage'] != df['sleepStage'].shift()
-    
-    # Create a cumulative sum of changes to identify continuous instances
-    df['boutId'] = df['sleepStageChange'].cumsum()
+def _compute_bout_durations(file):
+    """Bouts of one scoring CSV, split where the light/dark period changes."""
+    # Load only the two columns used below with Arrow's multithreaded reader; Timestamp
+    # is parsed while reading
+    df = pd.read_csv(
+        file,
+        engine='pyarrow',
+        usecols=['Timestamp', 'sleepStage'],
+        dtype=STAGE_DTYPES,
+        parse_dates=['Timestamp'],
+    )
     
-    # Determine the time period (light or dark) for each row
-    def get_time_period(row):
-        hour = row['Timestamp'].hour
-        if 9 <= hour < 21:
-            return 'Light'
-        else:
-            return 'Dark'
+    # Round the numbers in the sleepStage column to the nearest integer; blank stages stay NaN
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
     
-    df['timePeriod'] = df.apply(get_time_period, axis=1)
+    # Determine the time period (light or dark) for each row from the hour in one vector op
+    hours = df['Timestamp'].dt.hour.to_numpy()
+    is_light = (hours >= 9) & (hours < 21)
     
-    # Group by boutId and sleepStage, then calculate the count of rows for each bout
-    bout_durations = df.groupby(['boutId', 'sleepStage', 'timePeriod']).size().reset_index(name='boutDuration')
+    # A bout starts wherever the stage changes; a bout spanning lights on/off is split into
+    # one run per time period. Run lengths come straight from the boundary positions
+    stage = df['sleepStage'].to_numpy()
+    stage_change = np.ones(len(stage), dtype=bool)
+    stage_change[1:] = stage[1:] != stage[:-1]
+    period_change = np.zeros(len(stage), dtype=bool)
+    period_change[1:] = is_light[1:] != is_light[:-1]
+    starts = np.flatnonzero(stage_change | period_change)
+    lengths = np.diff(np.append(starts, len(stage)))
     
     # Map sleep stages to their corresponding names
     sleep_stage_map = {1: 'Wake', 2: 'NREM', 3: 'REM'}
-    bout_durations['sleepStage'] = bout_durations['sleepStage'].map(sleep_stage_map)
+    bout_durations = pd.DataFrame({
+        'boutId': np.cumsum(stage_change)[starts],
+        'sleepStage': pd.Series(stage[starts]).map(sleep_stage_map),
+        'timePeriod': np.where(is_light[starts], 'Light', 'Dark'),
+        'boutDuration': lengths,
+    })
     
     path_obj = Path(file)
     match = re.search(r"sub-(\d+)", path_obj.name, re.IGNORECASE)
@@ -66,77 +91,96 @@ for file in csv_files:
     else:
         subject_name = path_obj.stem
     bout_durations['Subject'] = subject_name
-    
-    # Append to the master list
-    all_bout_durations.append(bout_durations)
+    return bout_durations
 
-# Concatenate all bout durations into a single DataFrame
-all_bout_durations_df = pd.concat(all_bout_durations, ignore_index=True)
 
-def _subject_sort_key(label):
-    match = re.search(r"\d+", str(label))
-    return int(match.group()) if match else float('inf')
+def process_one(file):
+    """
+    Compute per-bout durations (split at light/dark changes) for one scoring CSV.
+    Bouts are cached next to the CSV as a Parquet sidecar and reused while it is newer than the CSV.
+    """
+    csv_path = Path(file)
+    cache_path = csv_path.with_suffix('.split_period_bouts.parquet')
+    if cache_path.exists() and cache_path.stat().st_mtime >= csv_path.stat().st_mtime:
+        return pd.read_parquet(cache_path)
+
+    bout_durations = _compute_bout_durations(file)
+    try:
+        bout_durations.to_parquet(cache_path, index=False)
+    except OSError as e:
+        print(f"Could not write bout cache {cache_path}: {e}")
+
+    return bout_durations
 
-unique_subjects = sorted(all_bout_durations_df['Subject'].unique(), key=_subject_sort_key)
-cmap = plt.get_cmap('tab10')
-subject_color_map = {subject: cmap(idx % cmap.N) for idx, subject in enumerate(unique_subjects)}
 
-# Create separate plots for Wake, NREM, and REM
-for sleep_stage in ['Wake', 'NREM', 'REM']:
-    # Filter the data for the current sleep stage
-    stage_data = all_bout_durations_df[all_bout_durations_df['sleepStage'] == sleep_stage]
+if __name__ == "__main__":
+    # List of CSV file paths
+    csv_files = glob.glob('/Volumes/harris/volkan/sleep-profile/downsample_auto_score/scoring_analysis/*.csv')
+
+    # Files are independent, so process them in parallel worker processes and concatenate
+    # all bout durations into a single DataFrame
+    with ProcessPoolExecutor() as executor:
+        all_bout_durations_df = pd.concat(executor.map(process_one, csv_files), ignore_index=True)
+
+    unique_subjects = sorted(all_bout_durations_df['Subject'].unique(), key=_subject_sort_key)
+    cmap = plt.get_cmap('tab10')
+    subject_color_map = {subject: cmap(idx % cmap.N) for idx, subject in enumerate(unique_subjects)}
+    rng = np.random.default_rng(seed=42)
+
+    # Create separate plots for Wake, NREM, and REM
+    for sleep_stage in ['Wake', 'NREM', 'REM']:
+        # Filter the data for the current sleep stage
+        stage_data = all_bout_durations_df[all_bout_durations_df['sleepStage'] == sleep_stage]
     
-    fig, ax = plt.subplots(figsize=(10, 6))
-
-    time_periods = ['Light', 'Dark']
-    sns.stripplot(
-        data=stage_data,
-        x='timePeriod',
-        y='boutDuration',
-        hue='Subject',
-        order=time_periods,
-        dodge=True,
-        palette=subject_color_map,
-        jitter=0.25,
-        alpha=0.7,
-        size=6,
-        ax=ax
-    )
-    if ax.legend_ is not None:
-        ax.legend_.remove()
+        fig, ax = plt.subplots(figsize=(10, 6))
+
+        time_periods = ['Light', 'Dark']
+        # Strip plot as one scatter: each subject gets its own dodge slot within the period
+        # column (0.8 wide, as in a dodged strip plot) plus uniform jitter within that slot
+        slot_width = 0.8 / len(unique_subjects)
+        subject_slot = {subject: idx for idx, subject in enumerate(unique_subjects)}
+        slots = stage_data['Subject'].map(subject_slot).to_numpy()
+        x_vals = (
+            (stage_data['timePeriod'] == 'Dark').to_numpy().astype(float)
+            - 0.4 + (slots + 0.5) * slot_width
+            + rng.uniform(-0.25, 0.25, size=len(stage_data)) * slot_width
+        )
+        colors = [subject_color_map[subject] for subject in stage_data['Subject']]
+        ax.scatter(x_vals, stage_data['boutDuration'], c=colors, s=36, alpha=0.7, linewidths=0)
+        ax.set_xlim(-0.5, len(time_periods) - 0.5)
     
-    # Get y-limits from data and set ticks
-    y_limits = {
-        'Wake': 16000,
-        'NREM': 1000,
-        'REM': 350
-    }
-    y_tick_max = {
-        'Wake': 15000,
-        'NREM': 900,
-        'REM': 300
-    }
-    tick_max = y_tick_max[sleep_stage]
-    yticks = np.linspace(0, tick_max, 4)
-    ax.set_yticks(yticks)
-    ax.set_ylim(0, y_limits[sleep_stage])
+        # Get y-limits from data and set ticks
+        y_limits = {
+            'Wake': 16000,
+            'NREM': 1000,
+            'REM': 350
+        }
+        y_tick_max = {
+            'Wake': 15000,
+            'NREM': 900,
+            'REM': 300
+        }
+        tick_max = y_tick_max[sleep_stage]
+        yticks = np.linspace(0, tick_max, 4)
+        ax.set_yticks(yticks)
+        ax.set_ylim(0, y_limits[sleep_stage])
     
-    # Customize the plot with explicit font sizes
-    ax.set_xticks(range(len(time_periods)))
-    ax.set_xticklabels(time_periods, fontsize=20)
-    ax.set_ylabel('Bout Duration (seconds)', fontsize=20)
-    ax.set_xlabel('')
-    ax.tick_params(axis='y', labelsize=20)
-    ax.set_title(f'{sleep_stage}', fontsize=22, pad=20)
-    ax.grid(axis='y', linestyle='--', alpha=0)
-
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-
-    # Save high-resolution figure
-    plt.tight_layout()
-    output_png = f'/Volumes/harris/volkan/sleep-profile/plots/bout_duration/bout_duration_individual_{sleep_stage}.png'
-    plt.savefig(output_png, dpi=600, bbox_inches='tight')
-    output_pdf = output_png[:-4] + '.pdf'
-    plt.savefig(output_pdf, dpi=600, bbox_inches='tight')
-    plt.close()
+        # Customize the plot with explicit font sizes
+        ax.set_xticks(range(len(time_periods)))
+        ax.set_xticklabels(time_periods, fontsize=20)
+        ax.set_ylabel('Bout Duration (seconds)', fontsize=20)
+        ax.set_xlabel('')
+        ax.tick_params(axis='y', labelsize=20)
+        ax.set_title(f'{sleep_stage}', fontsize=22, pad=20)
+        ax.grid(axis='y', linestyle='--', alpha=0)
+
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+
+        # Save high-resolution figure
+        plt.tight_layout()
+        output_png = f'/Volumes/harris/volkan/sleep-profile/plots/bout_duration/bout_duration_individual_{sleep_stage}.png'
+        plt.savefig(output_png, dpi=600, bbox_inches='tight')
+        output_pdf = output_png[:-4] + '.pdf'
+        plt.savefig(output_pdf, dpi=600, bbox_inches='tight')
+        plt.close()
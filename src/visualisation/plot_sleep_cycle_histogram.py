@@ -2,6 +2,27 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import timedelta
 import glob
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 plt.rcParams.update({
     'font.family': 'Arial',
@@ -24,8 +45,9 @@ def analyze_sleep_cycles(file_path):
     Returns DataFrame with start_time, end_time, and cycle_length (in minutes).
     """
     # Read CSV file and ensure timestamp is datetime type
-    df = pd.read_csv(file_path)
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    df = pd.read_csv(file_path, dtype=STAGE_DTYPES)
+    df['sleepStage'] = round_stage_codes(df['sleepStage'])
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], format='ISO8601', cache=True)
     
     # Find all REM stage end times
     rem_ends = []
@@ -81,13 +103,13 @@ def process_multiple_files(folder_path):
     Returns a combined DataFrame of cycle lengths.
     """
     all_files = glob.glob(f"{folder_path}/*.csv")
-    combined_data = pd.DataFrame()
+    results = []
     
     for file in all_files:
-        df = analyze_sleep_cycles(file)
-        combined_data = pd.concat([combined_data, df], ignore_index=True)
+        results.append(analyze_sleep_cycles(file))
     
-    return combined_data
+    # Concatenate once rather than re-copying the running frame on every file
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
 
 def plot_histogram(cycles_data, save_path=None):
     """
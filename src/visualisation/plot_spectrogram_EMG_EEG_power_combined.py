@@ -1,9 +1,15 @@
+import hashlib
+import os
 import pickle
+import tempfile
+import zipfile
 import numpy as np
 from scipy import signal
+from scipy.fft import next_fast_len, set_workers
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, sosfiltfilt
+from functools import lru_cache
 import pandas as pd
 
 # Set global style for publication
@@ -28,18 +34,76 @@ class EEGRecording:
         self.start_time = datetime.strptime(recording_start_time, "%Y-%m-%d %H:%M:%S")
         self.fs = fs
         
-    def get_segment(self, segment_start_time, duration_mins):
+    def get_segment_indices(self, segment_start_time, duration_mins):
         start_delta = datetime.strptime(segment_start_time, "%Y-%m-%d %H:%M:%S") - self.start_time
         start_idx = int(start_delta.total_seconds() * self.fs)
         n_samples = int(duration_mins * 60 * self.fs)
-        return self.data[start_idx:start_idx + n_samples]
+        return start_idx, start_idx + n_samples
+        
+    def get_segment(self, segment_start_time, duration_mins):
+        start_idx, end_idx = self.get_segment_indices(segment_start_time, duration_mins)
+        return self.data[start_idx:end_idx]
 
-def bandpass_filter(data, lowcut, highcut, fs, order=2):
+def _write_atomic(path, write):
+    """Write a file through a temporary file in the same directory and move it into place,
+    so an interrupted write never leaves a partial file at path."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def load_channels(pickle_path, channels):
+    """Memory-mapped float32 channels of a recording pickle.
+
+    Each channel is converted once to a '<pickle>.<channel>.npy' sidecar next to the pickle
+    (rebuilt when the pickle is newer or the sidecar is unreadable), so later calls only page
+    in the samples that are sliced. float32 is ample for EEG/EMG resolution and halves
+    memory traffic in the FFTs and filters. If the sidecars cannot be used, the channels are
+    returned as in-memory arrays.
+    """
+    sidecars = {channel: f"{pickle_path}.{channel}.npy" for channel in channels}
+    pickle_mtime = os.path.getmtime(pickle_path)
+    if all(os.path.exists(path) and os.path.getmtime(path) >= pickle_mtime
+           for path in sidecars.values()):
+        try:
+            return {channel: np.load(path, mmap_mode='r') for channel, path in sidecars.items()}
+        except (OSError, EOFError, ValueError) as e:
+            print(f"Could not load channel sidecars for {pickle_path}, rebuilding: {e}")
+
+    with open(pickle_path, 'rb') as f:
+        data = pickle.load(f)
+    arrays = {channel: np.ascontiguousarray(data[channel], dtype=np.float32)
+              for channel in channels}
+
+    # Each sidecar is written to a temporary file and moved into place, so an interrupted
+    # write never leaves a truncated sidecar that looks newer than the pickle
+    try:
+        for channel, path in sidecars.items():
+            _write_atomic(path, lambda out, array=arrays[channel]: np.save(out, array))
+        print(f"Wrote channel sidecars {', '.join(sidecars.values())}")
+    except OSError as e:
+        print(f"Could not write channel sidecars for {pickle_path}: {e}")
+
+    return arrays
+
+@lru_cache(maxsize=32)
+def _design_bandpass(lowcut, highcut, fs, order):
     nyquist = 0.5 * fs
     low = lowcut / nyquist
     high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-    return filtfilt(b, a, data)
+    return butter(order, [low, high], btype='band', output='sos')
+
+def bandpass_filter(data, lowcut, highcut, fs, order=2):
+    # Coefficients are memoised: every band is redesigned only once per session
+    sos = _design_bandpass(lowcut, highcut, fs, order)
+    return sosfiltfilt(sos, data)
 
 def calculate_power(signal, fs, window_size):
     """Calculate power in non-overlapping windows.
@@ -48,20 +112,78 @@ def calculate_power(signal, fs, window_size):
     Second value = window_size to 2*window_size seconds
     etc.
     """
-    power = []
-    window_samples = window_size * fs
+    window_samples = int(window_size * fs)
     
-    # Make windows explicit
-    total_windows = len(signal) // window_samples
-    for i in range(total_windows):
-        start = i * window_samples
-        end = start + window_samples
-        segment = signal[start:end]
-        if len(segment) == window_samples:  # Only process complete windows
-            segment_power = np.mean(segment**2)  # Changed from np.sum to np.mean for better scaling
-            power.append(segment_power)
-    
-    return np.array(power)
+    # Only complete windows are kept; windows run along the last axis, so a stack of
+    # signals yields one power row per signal. einsum squares and sums in one pass
+    signal = np.asarray(signal, dtype=np.float32)
+    total_windows = signal.shape[-1] // window_samples
+    segments = signal[..., :total_windows * window_samples].reshape(
+        *signal.shape[:-1], total_windows, window_samples)
+    return np.einsum('...ij,...ij->...i', segments, segments) / window_samples
+
+def spectrogram_band_power(f, Sxx, bands, frames_per_window):
+    """Band power per window from a PSD spectrogram.
+
+    Each band's power is the PSD summed over its bins times the bin width; consecutive
+    frames are then averaged in groups of frames_per_window (incomplete groups dropped).
+    Returns one row per (lowcut, highcut) band.
+    """
+    df = f[1] - f[0]
+    band_rows = np.stack([Sxx[(f >= low) & (f <= high)].sum(axis=0) * df for low, high in bands])
+    total_windows = band_rows.shape[1] // frames_per_window
+    return band_rows[:, :total_windows * frames_per_window].reshape(
+        len(bands), total_windows, frames_per_window).mean(axis=2)
+
+@lru_cache(maxsize=8)
+def _spectrogram_window(nperseg):
+    # scipy's default spectrogram taper, built once per segment length in the signal's dtype
+    return signal.get_window(('tukey', 0.25), nperseg).astype(np.float32)
+
+def get_spectrogram(pickle_path, start_idx, end_idx, signal_segment, fs,
+                    decimation=2, nperseg=256 * 2, nfft=1024):
+    """Spectrogram of a recording segment, cached as .npz in the temp directory.
+
+    Only 1-64 Hz is displayed, so the segment is first decimated (512 -> 256 Hz by
+    default); nperseg and nfft apply at the decimated rate. A factor of 4 would roll the
+    anti-aliasing filter off inside the display band (-6 dB at 64 Hz). The cache key
+    covers the pickle path and modification time, the segment's sample indices and the
+    spectrogram parameters, so re-plotting the same window skips the FFTs.
+    """
+    key = (str(pickle_path), os.path.getmtime(pickle_path), start_idx, end_idx,
+           fs, decimation, nperseg, nfft)
+    cache_dir = os.path.join(tempfile.gettempdir(), 'spec_cache')
+    cache_path = os.path.join(cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.npz')
+    if os.path.exists(cache_path):
+        # An unreadable cache entry is treated as a miss and recomputed
+        try:
+            with np.load(cache_path) as cached:
+                return cached['f'], cached['t'], cached['Sxx']
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"Ignoring unreadable spectrogram cache {cache_path}: {e}")
+
+    # Zero-phase FIR anti-aliasing keeps the display band flat and the time axis aligned
+    if decimation > 1:
+        signal_segment = signal.decimate(signal_segment, decimation, ftype='fir', zero_phase=True)
+
+    # One-sided (real-input) FFTs across all cores at a pocketfft-friendly length
+    with set_workers(-1):
+        f, t, Sxx = signal.spectrogram(signal_segment, 
+                                      fs=fs / decimation,
+                                      window=_spectrogram_window(nperseg),
+                                      nperseg=nperseg,  # 2-second windows by default
+                                      noverlap=nperseg//2,
+                                      nfft=next_fast_len(nfft),  # 0.25 Hz bins by default
+                                      detrend='constant',  # keeps DC leakage out of the 1-4 Hz band power
+                                      return_onesided=True)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_atomic(cache_path, lambda out: np.savez(out, f=f, t=t, Sxx=Sxx))
+    except OSError as e:
+        print(f"Could not write spectrogram cache {cache_path}: {e}")
+
+    return f, t, Sxx
 
 def combined_plot(pickle_path, recording_start_time, segment_start_time, duration_mins, 
                  lowcut=1, highcut=4, ratio_lowcut1=5, ratio_highcut1=10,
@@ -69,17 +191,14 @@ def combined_plot(pickle_path, recording_start_time, segment_start_time, duratio
     # Sampling rate definition moved to top
     fs = 512
     
-    # Load data
-    with open(pickle_path, 'rb') as f:
-        data = pickle.load(f)
+    # Load data as memory-mapped channels; only the plotted segment is read from disk
+    data = load_channels(pickle_path, ('EEG1', 'EMG'))
     recording = EEGRecording(data['EEG1'], recording_start_time)
     emg_data = data['EMG']
     
-    # Get segments
-    signal_segment = recording.get_segment(segment_start_time, duration_mins)
-    start_idx = int((datetime.strptime(segment_start_time, "%Y-%m-%d %H:%M:%S") - 
-                    datetime.strptime(recording_start_time, "%Y-%m-%d %H:%M:%S")).total_seconds() * fs)
-    end_idx = start_idx + int(duration_mins * 60 * fs)
+    # Get segments; EEG and EMG share sample indices, so the segment bounds are parsed once
+    start_idx, end_idx = recording.get_segment_indices(segment_start_time, duration_mins)
+    signal_segment = recording.data[start_idx:end_idx]
     emg_segment = emg_data[start_idx:end_idx]
     
     # Create figure with GridSpec spacer between spectrogram and power plots
@@ -101,27 +220,39 @@ def combined_plot(pickle_path, recording_start_time, segment_start_time, duratio
                         bottom=0.05)
 
     # Spectrogram (top)
-    nperseg = 512 * 2  # 2-second windows
-    f, t, Sxx = signal.spectrogram(signal_segment, 
-                                  fs=fs,
-                                  nperseg=nperseg,
-                                  noverlap=nperseg//2,
-                                  nfft=2048)
+    f, t, Sxx = get_spectrogram(pickle_path, start_idx, end_idx, signal_segment, fs)
     
     # Filter and normalize
     mask = (f >= 1) & (f <= 64)
-    power_db = 10 * np.log10(Sxx[mask])
-    vmin = np.percentile(power_db, 0.1)  # More extreme minimum
-    vmax = np.percentile(power_db, 99.9)  # More extreme maximum
-    
-    plt.sca(ax1)
-    plt.pcolormesh(t, f[mask], power_db,
-                   cmap='jet',      # Use viridis colormap for spectrogram
-                   shading='gouraud',
-                   vmin=vmin,
-                   vmax=vmax)
-    plt.yscale('log')
-    plt.yticks([1, 4, 16, 64], ['1', '4', '16', '64'], fontsize=17)
+    # Gather the displayed rows into one float32 buffer and convert to dB in place
+    rows = np.flatnonzero(mask)
+    power_db = np.empty((rows.size, Sxx.shape[1]), dtype=np.float32)
+    np.take(Sxx, rows, axis=0, out=power_db)
+    np.log10(power_db, out=power_db)
+    power_db *= 10.0
+    # Colour limits only need an estimate, so take the extreme percentiles from a
+    # fixed-seed random subsample (reproducible plots) rather than every bin
+    flat = power_db.ravel()
+    if flat.size > 20000:
+        flat = flat[np.random.default_rng(0).integers(0, flat.size, size=20000)]
+    vmin, vmax = np.percentile(flat, [0.1, 99.9])  # More extreme minimum / maximum
+    
+    # Bins are evenly spaced in time and frequency, so draw them as an image: the backend's
+    # bilinear resampling is much cheaper than gouraud-shading a mesh at savefig dpi.
+    # t and f are bin centres, while extent gives the outer pixel edges
+    dt = t[1] - t[0]
+    df = f[1] - f[0]
+    ax1.imshow(power_db,
+               origin='lower',
+               aspect='auto',
+               extent=[t[0] - dt / 2, t[-1] + dt / 2, f[rows[0]] - df / 2, f[rows[-1]] + df / 2],
+               cmap='jet',      # Use viridis colormap for spectrogram
+               vmin=vmin,
+               vmax=vmax,
+               interpolation='bilinear')
+    ax1.set_yscale('log')
+    ax1.set_yticks([1, 4, 16, 64])
+    ax1.set_yticklabels(['1', '4', '16', '64'], fontsize=17)
     ax1.set_ylabel('Frequency (Hz)', fontsize=17)
     ax1.set_ylim(1, 64)
     ax1.yaxis.set_minor_locator(plt.NullLocator())  # Remove minor ticks
@@ -136,45 +267,36 @@ def combined_plot(pickle_path, recording_start_time, segment_start_time, duratio
     total_duration = t[-1] - t[0]
     emg_times = np.arange(window_size/2, total_duration, window_size)[:len(emg_power)]
     
-    plt.sca(ax2)
-    plt.plot(emg_times, emg_power, color='black', linewidth=1.5)
+    ax2.plot(emg_times, emg_power, color='black', linewidth=1.5)
     
-    # EEG Power plot (bottom)
-    b, a = butter(2, [lowcut, highcut], btype='band', fs=fs)
-    filtered_eeg = filtfilt(b, a, signal_segment)
-    eeg_power = calculate_power(filtered_eeg, fs, window_size)
+    # EEG bands inside the spectrogram range are integrated from Sxx instead of being
+    # refiltered; 40-100 Hz keeps the filter path on the full-rate signal
+    eeg_bands = [
+        (lowcut, highcut),                  # EEG power
+        (ratio_lowcut1, ratio_highcut1),    # ratio numerator
+        (ratio_lowcut2, ratio_highcut2),    # ratio denominator
+        (9, 25),
+    ]
+    frames_per_window = int(round(window_size / (t[1] - t[0])))
+    eeg_power, power1, power2, power_925 = spectrogram_band_power(f, Sxx, eeg_bands, frames_per_window)
     
-    # Use same time points for EEG
-    plt.sca(ax3)
-    plt.plot(emg_times[:len(eeg_power)], eeg_power, color='black', linewidth=1.5)
-    
-    # Add EEG Power Ratio plot (bottom)
-    # Calculate power ratio using two frequency bands
-    filtered_eeg1 = bandpass_filter(signal_segment, ratio_lowcut1, ratio_highcut1, fs=fs)
-    filtered_eeg2 = bandpass_filter(signal_segment, ratio_lowcut2, ratio_highcut2, fs=fs)
+    filtered_eeg_40100 = bandpass_filter(signal_segment, 40, 100, fs=fs)
+    power_40100 = calculate_power(filtered_eeg_40100, fs, window_size)
     
-    power1 = calculate_power(filtered_eeg1, fs, window_size)
-    power2 = calculate_power(filtered_eeg2, fs, window_size)
+    # EEG Power plot (bottom); use same time points for EEG
+    ax3.plot(emg_times[:len(eeg_power)], eeg_power, color='black', linewidth=1.5)
     
+    # Add EEG Power Ratio plot (bottom)
     # Calculate ratio and use same time points
-    power_ratio = np.array(power1) / np.array(power2)
+    power_ratio = power1 / power2
     
-    plt.sca(ax4)
-    plt.plot(emg_times[:len(power_ratio)], power_ratio, color='black', linewidth=1.5)
+    ax4.plot(emg_times[:len(power_ratio)], power_ratio, color='black', linewidth=1.5)
     
     # Add EEG Power plot for 9-25Hz (bottom)
-    filtered_eeg_925 = bandpass_filter(signal_segment, 9, 25, fs=fs)
-    power_925 = calculate_power(filtered_eeg_925, fs, window_size)
-    
-    plt.sca(ax5)
-    plt.plot(emg_times[:len(power_925)], power_925, color='black', linewidth=1.5)
+    ax5.plot(emg_times[:len(power_925)], power_925, color='black', linewidth=1.5)
     
     # Add EEG Power plot for 40-100Hz (bottom)
-    filtered_eeg_40100 = bandpass_filter(signal_segment, 40, 100, fs=fs)
-    power_40100 = calculate_power(filtered_eeg_40100, fs, window_size)
-    
-    plt.sca(ax6)
-    plt.plot(emg_times[:len(power_40100)], power_40100, color='black', linewidth=1.5)
+    ax6.plot(emg_times[:len(power_40100)], power_40100, color='black', linewidth=1.5)
     
     # Clean up and add scale bar
     # Spectrogram cleanup (keep y-ticks)
@@ -207,16 +329,18 @@ def combined_plot(pickle_path, recording_start_time, segment_start_time, duratio
     # Save figure if path is provided
     if save_path:
         # Save as PNG
-        plt.savefig(save_path, dpi=600, bbox_inches='tight')
+        fig.savefig(save_path, dpi=600, bbox_inches='tight')
         
         # Save as PDF (replace .png extension with .pdf)
         if save_path.endswith('.png'):
             pdf_path = save_path.replace('.png', '.pdf')
         else:
             pdf_path = save_path + '.pdf'
-        plt.savefig(pdf_path, format='pdf', bbox_inches='tight')
+        fig.savefig(pdf_path, format='pdf', bbox_inches='tight')
     
     plt.show()
+    # Release the figure so batch runs over many sessions don't accumulate 600 dpi canvases
+    plt.close(fig)
 
 # Example usage
 combined_plot(
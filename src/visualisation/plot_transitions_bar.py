@@ -1,6 +1,27 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import sys
+from pathlib import Path
+
+
+def _ensure_repo_root_on_path():
+    repo_root = Path(__file__).resolve()
+    for parent in repo_root.parents:
+        if (parent / "src" / "stage_colors.py").exists():
+            repo_root = parent
+            break
+    else:
+        repo_root = repo_root.parent
+
+    repo_root_str = str(repo_root)
+    if repo_root_str not in sys.path:
+        sys.path.append(repo_root_str)
+
+
+_ensure_repo_root_on_path()
+
+from src.stage_codes import STAGE_DTYPES, round_stage_codes
 
 plt.rcParams.update({
     'font.family': 'Arial',
@@ -31,11 +52,12 @@ def plot_sleep_transitions_multiple(files, output_dir=None, dpi=600):
     # Loop over the files and process each one
     for file_path in files:
         # Load the current CSV file into a DataFrame
-        df = pd.read_csv(file_path)
+        df = pd.read_csv(file_path, dtype=STAGE_DTYPES)
         
         # Ensure that the sleepStage column exists in the current file
         if 'sleepStage' not in df.columns:
             raise ValueError(f"The file {file_path} must contain a 'sleepStage' column")
+        df['sleepStage'] = round_stage_codes(df['sleepStage'])
         
         # Loop through the dataframe and count the transitions
         for i in range(len(df) - 1):